@@ -3,6 +3,68 @@ import csv
 import os
 from datetime import datetime
 
+# Columns written by the filtered exports (CSV header / NDJSON keys)
+EXPORT_FIELDS = ['title', 'link', 'category', 'price', 'location', 'surface', 'scraping_date']
+
+
+def build_filtered_query(categories, min_date=None, max_date=None, max_results=None):
+    """
+    Build the filtered export query over the unified listings table
+    
+    All categories are read in one indexed query; the per-category limit is
+    applied with ROW_NUMBER() over each category partition.
+    
+    Args:
+        categories (list): Categories to export
+        min_date (str): Minimum scraping date (YYYY-MM-DD format)
+        max_date (str): Maximum scraping date (YYYY-MM-DD format, inclusive)
+        max_results (int): Maximum number of rows per category
+    
+    Returns:
+        tuple: (query, params)
+    """
+    columns = "titre, lien, category, prix, localisation, surface, date_scraping"
+    query = f"""
+        SELECT {columns}{", ROW_NUMBER() OVER (PARTITION BY category ORDER BY date_scraping DESC) AS rank" if max_results else ""}
+        FROM listings
+        WHERE category IN ({', '.join('?' * len(categories))})
+        AND lien IS NOT NULL 
+        AND lien != 'N/A' 
+        AND lien != ''
+        AND lien LIKE '%mubawab.ma%'
+    """
+    
+    params = list(categories)
+    
+    # Add date filters
+    if min_date:
+        query += " AND date_scraping >= ?"
+        params.append(min_date)
+    
+    if max_date:
+        query += " AND date(date_scraping) <= date(?)"
+        params.append(max_date)
+    
+    # Add per-category limit
+    if max_results:
+        query = f"SELECT {columns} FROM ({query}) WHERE rank <= ?"
+        params.append(max_results)
+    
+    query += " ORDER BY category, date_scraping DESC"
+    
+    return query, params
+
+
+def format_export_row(row):
+    """
+    Convert a row returned by build_filtered_query into EXPORT_FIELDS order
+    """
+    titre, lien, category, prix, localisation, surface, date_scraping = row
+    clean_title = ' '.join(titre.strip().split()) if titre else 'N/A'
+    return (clean_title, lien, category, prix or 'N/A',
+            localisation or 'N/A', surface or 'N/A', date_scraping)
+
+
 def export_all_property_links_to_csv(db_path="mubawab_marrakech_lastversion.db", output_file="property_links.csv"):
     """
     Extracts all property links from the Mubawab SQLite database and exports to CSV
@@ -43,52 +105,26 @@ def export_all_property_links_to_csv(db_path="mubawab_marrakech_lastversion.db",
             writer.writerow(['title', 'link', 'category'])
             
             total_exported = 0
-            stats = {}
+            stats = {category: 0 for category in PROPERTY_CONFIGS}
+            
+            # Single query over the unified listings table for every property type
+            query, params = build_filtered_query(list(PROPERTY_CONFIGS))
             
-            # Process each property type
-            for category, config in PROPERTY_CONFIGS.items():
-                table_name = config['table_name']
+            try:
+                cursor.execute(query, params)
                 
-                try:
-                    # Check if table exists
-                    cursor.execute("""
-                        SELECT name FROM sqlite_master 
-                        WHERE type='table' AND name=?
-                    """, (table_name,))
-                    
-                    if not cursor.fetchone():
-                        print(f"⚠️  Table '{table_name}' not found, skipping {category}")
-                        stats[category] = 0
-                        continue
-                    
-                    # Query all properties with valid links
-                    cursor.execute(f"""
-                        SELECT titre, lien FROM {table_name}
-                        WHERE lien IS NOT NULL 
-                        AND lien != 'N/A' 
-                        AND lien != ''
-                        AND lien LIKE '%mubawab.ma%'
-                        ORDER BY date_scraping DESC
-                    """)
-                    
-                    properties = cursor.fetchall()
-                    category_count = 0
-                    
-                    # Write properties to CSV
-                    for titre, lien in properties:
-                        # Clean title (remove newlines, extra spaces)
-                        clean_title = ' '.join(titre.strip().split()) if titre else 'N/A'
-                        
-                        writer.writerow([clean_title, lien, category])
-                        category_count += 1
-                        total_exported += 1
-                    
-                    stats[category] = category_count
+                # Write properties to CSV (title cleaned of newlines and extra spaces)
+                for row in cursor:
+                    clean_title, lien, category = format_export_row(row)[:3]
+                    writer.writerow([clean_title, lien, category])
+                    stats[category] += 1
+                    total_exported += 1
+                
+                for category, category_count in stats.items():
                     print(f"✅ {category}: {category_count} properties exported")
-                    
-                except sqlite3.Error as e:
-                    print(f"❌ Error processing {category}: {e}")
-                    stats[category] = 0
+                
+            except sqlite3.Error as e:
+                print(f"❌ Error reading listings table (start main.py once to migrate): {e}")
         
         conn.close()
         
@@ -111,7 +147,7 @@ def export_all_property_links_to_csv(db_path="mubawab_marrakech_lastversion.db",
 
 
 def export_with_filters(db_path="mubawab_marrakech_lastversion.db", output_file="filtered_property_links.csv", 
-                       categories=None, min_date=None, max_results_per_category=None):
+                       categories=None, min_date=None, max_results_per_category=None, max_date=None):
     """
     Export property links with filters
     
@@ -121,6 +157,7 @@ def export_with_filters(db_path="mubawab_marrakech_lastversion.db", output_file=
         categories (list): List of categories to export (None = all)
         min_date (str): Minimum scraping date (YYYY-MM-DD format)
         max_results_per_category (int): Maximum results per category
+        max_date (str): Maximum scraping date (YYYY-MM-DD format, inclusive)
     """
     
     PROPERTY_CONFIGS = {
@@ -142,51 +179,28 @@ def export_with_filters(db_path="mubawab_marrakech_lastversion.db", output_file=
         
         with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['title', 'link', 'category', 'price', 'location', 'surface', 'scraping_date'])
+            writer.writerow(EXPORT_FIELDS)
             
             total_exported = 0
+            stats = {category: 0 for category in PROPERTY_CONFIGS}
             
-            for category, config in PROPERTY_CONFIGS.items():
-                table_name = config['table_name']
-                
-                # Build query with filters
-                query = f"""
-                    SELECT titre, lien, prix, localisation, surface, date_scraping 
-                    FROM {table_name}
-                    WHERE lien IS NOT NULL 
-                    AND lien != 'N/A' 
-                    AND lien != ''
-                    AND lien LIKE '%mubawab.ma%'
-                """
-                
-                params = []
-                
-                # Add date filter
-                if min_date:
-                    query += " AND date_scraping >= ?"
-                    params.append(min_date)
+            query, params = build_filtered_query(list(PROPERTY_CONFIGS), min_date, max_date,
+                                                 max_results_per_category)
+            
+            try:
+                cursor.execute(query, params)
                 
-                query += " ORDER BY date_scraping DESC"
+                for row in cursor:
+                    values = format_export_row(row)
+                    writer.writerow(values)
+                    stats[values[2]] += 1
+                    total_exported += 1
                 
-                # Add limit
-                if max_results_per_category:
-                    query += " LIMIT ?"
-                    params.append(max_results_per_category)
+                for category, category_count in stats.items():
+                    print(f"✅ {category}: {category_count} properties exported")
                 
-                try:
-                    cursor.execute(query, params)
-                    properties = cursor.fetchall()
-                    
-                    for titre, lien, prix, localisation, surface, date_scraping in properties:
-                        clean_title = ' '.join(titre.strip().split()) if titre else 'N/A'
-                        writer.writerow([clean_title, lien, category, prix or 'N/A', 
-                                       localisation or 'N/A', surface or 'N/A', date_scraping])
-                        total_exported += 1
-                    
-                    print(f"✅ {category}: {len(properties)} properties exported")
-                    
-                except sqlite3.Error as e:
-                    print(f"❌ Error processing {category}: {e}")
+            except sqlite3.Error as e:
+                print(f"❌ Error reading listings table (start main.py once to migrate): {e}")
         
         conn.close()
         print(f"\n🎉 Filtered export completed! Total: {total_exported} properties")
@@ -220,32 +234,31 @@ def check_database_stats(db_path="mubawab_marrakech_lastversion.db"):
         total_all = 0
         total_with_links = 0
         
-        for category, config in PROPERTY_CONFIGS.items():
-            table_name = config['table_name']
+        # Single grouped query over the unified listings table
+        counts = {}
+        try:
+            cursor.execute("""
+                SELECT category,
+                       COUNT(*),
+                       SUM(CASE WHEN lien IS NOT NULL 
+                                AND lien != 'N/A' 
+                                AND lien != ''
+                                AND lien LIKE '%mubawab.ma%' THEN 1 ELSE 0 END)
+                FROM listings
+                GROUP BY category
+            """)
+            counts = {category: (total, with_links) for category, total, with_links in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"❌ Error reading listings table (start main.py once to migrate): {e}")
+        
+        for category in PROPERTY_CONFIGS:
+            total, with_links = counts.get(category, (0, 0))
             
-            try:
-                # Total count
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                total = cursor.fetchone()[0]
-                
-                # Count with valid links
-                cursor.execute(f"""
-                    SELECT COUNT(*) FROM {table_name}
-                    WHERE lien IS NOT NULL 
-                    AND lien != 'N/A' 
-                    AND lien != ''
-                    AND lien LIKE '%mubawab.ma%'
-                """)
-                with_links = cursor.fetchone()[0]
-                
-                total_all += total
-                total_with_links += with_links
-                
-                percentage = (with_links / total * 100) if total > 0 else 0
-                print(f"{category:20}: {with_links:6}/{total:6} ({percentage:5.1f}%)")
-                
-            except sqlite3.Error as e:
-                print(f"{category:20}: Error - {e}")
+            total_all += total
+            total_with_links += with_links
+            
+            percentage = (with_links / total * 100) if total > 0 else 0
+            print(f"{category:20}: {with_links:6}/{total:6} ({percentage:5.1f}%)")
         
         print("-" * 50)
         print(f"{'TOTAL':20}: {total_with_links:6}/{total_all:6} ({total_with_links/total_all*100 if total_all > 0 else 0:5.1f}%)")
@@ -1,21 +1,56 @@
+import time
+_MODULE_LOAD_STARTED = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse, FileResponse, RedirectResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple, Union
 import sqlite3
 import asyncio
 import json
 from datetime import datetime
 import threading
-import requests
-from bs4 import BeautifulSoup
 import re
 import math
-import time
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 import queue
 import os
+import csv
+import io
+import zlib
+import uuid
+import socket
+import argparse
+import hashlib
+import struct
+import unicodedata
+import statistics
+import shutil
+
+from get_links import EXPORT_FIELDS, build_filtered_query, format_export_row
+
+# Encodeur JSON rapide (optionnel) - repli sur json standard
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Les dépendances du scraping (requests, bs4) et du pipeline d'images (httpx, Pillow)
+# sont importées à la demande : un worker qui ne sert que l'API démarre sans elles
+def optional_import(module_name: str):
+    """Importe un module optionnel à la demande ; None s'il n'est pas installé"""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        return None
+
+def parse_html(html_content: str):
+    """Construit l'arbre BeautifulSoup d'une page"""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_content, 'html.parser')
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
@@ -53,10 +88,51 @@ class Terrain(PropertyBase):
     id: int
     date_scraping: str
 
+# Enregistrements compacts produits par le parser et consommés tels quels
+# par l'écriture SQL (ordre des champs = ordre des colonnes insérées)
+class ListingRecord(NamedTuple):
+    titre: str
+    prix: str
+    localisation: str
+    surface: str
+    pieces: str
+    chambres: str
+    salles_de_bain: str
+    lien: str
+    ville: str
+    image_url: str
+
+class TerrainRecord(NamedTuple):
+    titre: str
+    prix: str
+    localisation: str
+    surface: str
+    lien: str
+    ville: str
+    image_url: str
+
+Record = Union[ListingRecord, TerrainRecord]
+
+class DetailRecord(NamedTuple):
+    listing_id: int
+    description: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    amenities: str
+
 class ScrapingRequest(BaseModel):
     property_type: str
     max_pages: Optional[int] = None
 
+class EnrichmentRequest(BaseModel):
+    property_type: Optional[str] = None
+    freshness_days: Optional[int] = None
+    max_listings: Optional[int] = None
+
+class ScheduleUpdate(BaseModel):
+    interval_minutes: Optional[int] = None
+    enabled: Optional[bool] = None
+
 class ScrapingStatus(BaseModel):
     status: str
     current_page: int
@@ -93,69 +169,770 @@ PROPERTY_CONFIGS = {
     }
 }
 
+def get_record_type(property_type: str):
+    """Retourne le type d'enregistrement correspondant au schéma de la table"""
+    return TerrainRecord if property_type == 'terrains' else ListingRecord
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
+}
+
+# Table unique regroupant toutes les catégories ; les anciens noms de tables
+# (appartements, villas, ...) sont conservés sous forme de vues
+LISTINGS_TABLE = 'listings'
+DETAILS_TABLE = 'listing_details'
+
+# File de tâches partagée entre workers (mode distribué)
+CRAWL_TASKS_TABLE = 'crawl_tasks'
+TASK_LEASE_SECONDS = 120
+TASK_HEARTBEAT_SECONDS = 30
+TASK_MAX_ATTEMPTS = 3
+
+# Cache local des images : miniatures adressées par contenu, servies par /images/{hash}
+IMAGE_PIPELINE_ENABLED = False
+IMAGES_TABLE = 'images'
+IMAGE_FILES_TABLE = 'image_files'
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGE_THUMBNAIL_SIZE = (480, 360)
+IMAGE_DOWNLOAD_CONCURRENCY = 8
+IMAGE_MAX_ATTEMPTS = 3
+# La date d'accès (éviction LRU) n'est réécrite qu'au-delà de ce délai
+IMAGE_ACCESS_UPDATE_SECONDS = 600
+
+# Détection des quasi-doublons (MinHash + LSH) entre toutes les catégories
+SIGNATURES_TABLE = 'listing_signatures'
+LSH_TABLE = 'listing_lsh'
+MINHASH_PERMUTATIONS = 32
+LSH_BANDS = 8
+DUPLICATE_THRESHOLD = 0.6
+# Écart relatif toléré sur le prix et la surface entre deux doublons
+DUPLICATE_NUMERIC_TOLERANCE = 0.05
+# En dessous de ce nombre de traits, une annonce n'est pas assez décrite pour être rapprochée
+DUPLICATE_MIN_FEATURES = 3
+
+# Agrégats précalculés par catégorie / localisation / jour
+ROLLUPS_TABLE = 'listing_rollups'
+ROLLUP_STATE_TABLE = 'rollup_state'
+
+# Planificateur de crawls récurrents (désactivé par défaut)
+CRAWL_RUNS_TABLE = 'crawl_runs'
+CRAWL_SCHEDULE_TABLE = 'crawl_schedule'
+SCHEDULER_ENABLED = False
+SCHEDULER_TICK_SECONDS = 30
+SCHEDULER_STAGGER_SECONDS = 120
+SCHEDULER_REQUESTS_PER_MINUTE = 60
+# Un seul processus planifie à la fois : bail SQLite renouvelé à chaque tick et après
+# chaque espacement, donc au moins deux fois plus long que l'écart maximal entre renouvellements
+SCHEDULER_LEASE_TABLE = 'scheduler_lease'
+SCHEDULER_LEASE_SECONDS = 2 * (SCHEDULER_STAGGER_SECONDS + SCHEDULER_TICK_SECONDS)
+# Un crawl « running » sans heartbeat depuis RUN_STALE_SECONDS est considéré interrompu
+RUN_HEARTBEAT_SECONDS = 30
+RUN_STALE_SECONDS = 120
+SCHEDULED_MAX_WORKERS = 3
+DEFAULT_CRAWL_INTERVAL_MINUTES = 360
+# Crawl incrémental si la catégorie a des données plus récentes que cette fenêtre
+INCREMENTAL_WINDOW_HOURS = 24
+INCREMENTAL_MAX_PAGES = 20
+
+# Fenêtre de fraîcheur par défaut : une annonce enrichie récemment n'est pas re-crawlée
+DETAILS_FRESHNESS_DAYS = 7
+
+def build_insert_sql(property_type: str, record_type) -> str:
+    """Construit la requête INSERT OR IGNORE dans la table unifiée pour une catégorie"""
+    columns = ', '.join(record_type._fields)
+    placeholders = ', '.join('?' * len(record_type._fields))
+    return (f"INSERT OR IGNORE INTO {LISTINGS_TABLE} (category, {columns}) "
+            f"VALUES ('{property_type}', {placeholders})")
+
 # Variable globale pour le chemin de la base de données - NOUVEAU FICHIER
 DB_PATH = "mubawab_marrakech_lastversion.db"
 
-def ensure_database_exists():
-    """S'assure que la base de données et toutes les tables existent"""
-    conn = sqlite3.connect(DB_PATH)
+def migrate_legacy_table(cursor: sqlite3.Cursor, property_type: str, table_name: str):
+    """Copie une ancienne table par catégorie dans la table unifiée puis la supprime"""
+    columns = ', '.join(get_record_type(property_type)._fields + ('date_scraping',))
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO {LISTINGS_TABLE} (category, {columns})
+        SELECT ?, {columns} FROM {table_name} ORDER BY id
+    """, (property_type,))
+    logger.info(f"Migration de {table_name}: {cursor.rowcount} annonces copiées")
+    cursor.execute(f"DROP TABLE {table_name}")
+
+# Version du schéma (PRAGMA user_version) : le DDL n'est rejoué que si elle change
+SCHEMA_VERSION = 6
+_schema_lock = threading.Lock()
+_schema_ready_path: Optional[str] = None
+
+def ensure_database_exists(force: bool = False):
+    """S'assure, une fois par processus, que la base et son schéma sont à jour"""
+    global _schema_ready_path
+    if _schema_ready_path == DB_PATH and not force:
+        return
+    
+    with _schema_lock:
+        if _schema_ready_path == DB_PATH and not force:
+            return
+        
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION or create_schema(conn):
+                _schema_ready_path = DB_PATH
+        finally:
+            conn.close()
+
+def create_schema(conn: sqlite3.Connection) -> bool:
+    """Crée la table unifiée, les tables annexes et les vues par catégorie"""
     cursor = conn.cursor()
     
     try:
-        # Créer toutes les tables nécessaires
+        # WAL : les lectures longues (exports) ne bloquent pas les écritures du scraping
+        cursor.execute("PRAGMA journal_mode=WAL")
+        conn.execute('BEGIN IMMEDIATE')
+        
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {LISTINGS_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                titre TEXT NOT NULL,
+                prix TEXT,
+                localisation TEXT,
+                surface TEXT,
+                pieces TEXT,
+                chambres TEXT,
+                salles_de_bain TEXT,
+                lien TEXT NOT NULL,
+                ville TEXT NOT NULL,
+                image_url TEXT,
+                date_scraping TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (category, lien)
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_listings_category_date "
+                       f"ON {LISTINGS_TABLE} (category, date_scraping)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_listings_lien ON {LISTINGS_TABLE} (lien)")
+        
+        # Détails issus des pages d'annonces (étape d'enrichissement)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {DETAILS_TABLE} (
+                listing_id INTEGER PRIMARY KEY REFERENCES {LISTINGS_TABLE} (id),
+                description TEXT,
+                latitude REAL,
+                longitude REAL,
+                amenities TEXT,
+                date_enrichissement TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Images dédupliquées par URL (clé = sha1 de l'URL) et fichiers du cache
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {IMAGES_TABLE} (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content_hash TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {IMAGE_FILES_TABLE} (
+                content_hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                media_type TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        
+        # Signatures MinHash, buckets LSH et clusters de quasi-doublons
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {SIGNATURES_TABLE} (
+                listing_id INTEGER PRIMARY KEY REFERENCES {LISTINGS_TABLE} (id),
+                signature BLOB NOT NULL,
+                price INTEGER,
+                surface INTEGER,
+                cluster_id INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_signatures_cluster ON {SIGNATURES_TABLE} (cluster_id)")
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {LSH_TABLE} (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                listing_id INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON {LSH_TABLE} (band, bucket)")
+        
+        # Agrégats (analytics) et position du dernier traitement incrémental
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {ROLLUPS_TABLE} (
+                category TEXT NOT NULL,
+                localisation TEXT NOT NULL,
+                day TEXT NOT NULL,
+                listing_count INTEGER NOT NULL,
+                priced_count INTEGER NOT NULL,
+                min_price INTEGER,
+                median_price REAL,
+                max_price INTEGER,
+                median_price_m2 REAL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (category, localisation, day)
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_rollups_day ON {ROLLUPS_TABLE} (day)")
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+                name TEXT PRIMARY KEY,
+                last_listing_id INTEGER NOT NULL
+            )
+        ''')
+        
+        # Historique des crawls (manuels et planifiés)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {CRAWL_RUNS_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                trigger TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                duration_seconds REAL,
+                pages INTEGER,
+                new_properties INTEGER,
+                error TEXT,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        ''')
+        # Bases en version 4 : propriétaire et heartbeat ajoutés aux crawls existants
+        run_columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({CRAWL_RUNS_TABLE})")}
+        for column, column_type in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+            if column not in run_columns:
+                cursor.execute(f"ALTER TABLE {CRAWL_RUNS_TABLE} ADD COLUMN {column} {column_type}")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_crawl_runs_category "
+                       f"ON {CRAWL_RUNS_TABLE} (category, started_at)")
+        # Intervalles et activation par catégorie, partagés par tous les processus
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {CRAWL_SCHEDULE_TABLE} (
+                category TEXT PRIMARY KEY,
+                interval_minutes INTEGER NOT NULL,
+                enabled INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {SCHEDULER_LEASE_TABLE} (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        
+        # File de tâches (catégorie, page) pour les workers distribués
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {CRAWL_TASKS_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                crawl_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                new_count INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (crawl_id, category, page_num)
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_crawl_tasks_status "
+                       f"ON {CRAWL_TASKS_TABLE} (status, lease_expires_at)")
+        
+        # Vues de compatibilité (avec migration des anciennes tables si besoin)
         for property_type, config in PROPERTY_CONFIGS.items():
             table_name = config['table_name']
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,))
+            row = cursor.fetchone()
             
-            if property_type == 'terrains':
-                cursor.execute(f'''
-                    CREATE TABLE IF NOT EXISTS {table_name} (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        titre TEXT NOT NULL,
-                        prix TEXT,
-                        localisation TEXT,
-                        surface TEXT,
-                        lien TEXT NOT NULL UNIQUE,
-                        ville TEXT NOT NULL,
-                        image_url TEXT,
-                        date_scraping TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-            else:
-                cursor.execute(f'''
-                    CREATE TABLE IF NOT EXISTS {table_name} (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        titre TEXT NOT NULL,
-                        prix TEXT,
-                        localisation TEXT,
-                        surface TEXT,
-                        pieces TEXT,
-                        chambres TEXT,
-                        salles_de_bain TEXT,
-                        lien TEXT NOT NULL UNIQUE,
-                        ville TEXT NOT NULL,
-                        image_url TEXT,
-                        date_scraping TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+            if row and row[0] == 'table':
+                migrate_legacy_table(cursor, property_type, table_name)
+            elif row:
+                continue
+            
+            columns = ', '.join(('id',) + get_record_type(property_type)._fields + ('date_scraping',))
+            cursor.execute(f"""
+                CREATE VIEW {table_name} AS
+                SELECT {columns} FROM {LISTINGS_TABLE}
+                WHERE category = '{property_type}'
+            """)
         
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
         logger.info("Base de données initialisée avec succès")
+        return True
         
     except Exception as e:
         logger.error(f"Erreur lors de l'initialisation de la base de données: {e}")
         conn.rollback()
-    finally:
-        conn.close()
+        return False
 
 def get_db_connection():
-    """Retourne une connexion à la base de données en s'assurant qu'elle existe"""
-    # Vérifier si le fichier DB existe, sinon le créer
-    if not os.path.exists(DB_PATH):
-        logger.info("Fichier de base de données manquant, création en cours...")
-        ensure_database_exists()
-    
+    """Retourne une connexion à la base de données en s'assurant que le schéma est prêt"""
+    ensure_database_exists()
     return sqlite3.connect(DB_PATH, timeout=30.0)
 
+class QueryTimeoutError(Exception):
+    """Levée quand une requête dépasse le délai autorisé"""
+
+# Pool de threads dédié aux accès SQLite de l'API
+DB_MAX_WORKERS = 4
+DB_QUERY_TIMEOUT = 10.0
+# Pool séparé (un thread) pour les traitements longs : doublons et agrégats
+MAINTENANCE_QUERY_TIMEOUT = 300.0
+
+class AsyncDatabase:
+    """Interface async d'accès à SQLite : pool de threads dédié, concurrence bornée et timeouts
+
+    Les fonctions synchrones s'exécutent hors de la boucle d'événements ; une requête
+    qui dépasse le délai est interrompue côté SQLite (progress handler).
+    """
+    def __init__(self, max_workers: int = DB_MAX_WORKERS, query_timeout: float = DB_QUERY_TIMEOUT,
+                 name: str = "db"):
+        self.max_workers = max_workers
+        self.query_timeout = query_timeout
+        self.name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _run_with_connection(self, deadline: float, func, args):
+        conn = get_db_connection()
+        timed_out = False
+
+        def check_deadline():
+            nonlocal timed_out
+            timed_out = time.monotonic() > deadline
+            return 1 if timed_out else 0
+
+        # Vérifié toutes les 1000 instructions de la VM SQLite
+        conn.set_progress_handler(check_deadline, 1000)
+        try:
+            result = func(conn, *args)
+        except sqlite3.OperationalError:
+            if timed_out:
+                raise QueryTimeoutError()
+            raise
+        finally:
+            conn.close()
+        if timed_out:
+            raise QueryTimeoutError()
+        return result
+
+    async def run(self, func, *args, timeout: Optional[float] = None):
+        """Exécute func(conn, *args) dans le pool DB avec une connexion dédiée"""
+        timeout = timeout or self.query_timeout
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._run_with_connection, deadline, func, args)
+        try:
+            # Petite marge : l'interruption SQLite doit normalement se produire avant
+            return await asyncio.wait_for(future, timeout + 1.0)
+        except asyncio.TimeoutError:
+            raise QueryTimeoutError()
+
+    async def call(self, func, *args):
+        """Exécute une fonction bloquante (sans connexion) dans le pool DB"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+db = AsyncDatabase()
+# Les passes de dédoublonnage et d'agrégats ne monopolisent pas les threads des requêtes API
+maintenance_db = AsyncDatabase(max_workers=1, query_timeout=MAINTENANCE_QUERY_TIMEOUT, name="maintenance")
+
+def fetch_properties_page(conn: sqlite3.Connection, table_name: str, query: str,
+                          limit: int, offset: int):
+    """Retourne (total, propriétés) pour une page de résultats"""
+    cursor = conn.cursor()
+    try:
+        # Compte total
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        total = cursor.fetchone()[0]
+        
+        # Récupération des données
+        cursor.execute(query, (limit, offset))
+        
+        columns = [description[0] for description in cursor.description]
+        properties = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        
+        if IMAGE_PIPELINE_ENABLED:
+            for prop in properties:
+                if (prop.get('image_url') or '').startswith('http'):
+                    prop['image_hash'] = ImageCache.key(prop['image_url'])
+        
+    except sqlite3.OperationalError as e:
+        if str(e) == 'interrupted':
+            raise
+        # Si la table n'existe pas, la créer et retourner des résultats vides
+        logger.warning(f"Table {table_name} n'existe pas, création en cours...")
+        ensure_database_exists(force=True)
+        total = 0
+        properties = []
+    
+    return total, properties
+
+def count_by_category(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Compte les annonces de chaque type de propriété (une seule requête indexée)"""
+    stats = {prop_type: 0 for prop_type in PROPERTY_CONFIGS}
+    try:
+        cursor = conn.execute(f"SELECT category, COUNT(*) FROM {LISTINGS_TABLE} GROUP BY category")
+        for category, count in cursor:
+            if category in stats:
+                stats[category] = count
+    except sqlite3.OperationalError as e:
+        # Si la table n'existe pas encore, toutes les catégories restent à 0
+        if str(e) == 'interrupted':
+            raise
+    
+    return stats
+
+def recreate_database():
+    """Supprime le fichier de base (fichiers WAL et cache d'images compris) puis recrée le schéma"""
+    for path in (DB_PATH, f"{DB_PATH}-wal", f"{DB_PATH}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Fichier supprimé: {path}")
+    shutil.rmtree(IMAGE_CACHE_DIR, ignore_errors=True)
+    
+    # Recréer la base de données
+    ensure_database_exists(force=True)
+
+class ImageCache:
+    """Cache disque borné des miniatures d'annonces
+
+    Les URLs d'images sont dédupliquées (une ligne par URL dans `images`), téléchargées
+    en asynchrone avec une concurrence bornée puis réduites (Pillow si disponible).
+    Les fichiers sont nommés d'après le sha256 de leur contenu ; au-delà de max_bytes,
+    les moins récemment servis sont supprimés.
+    """
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+                 concurrency: int = IMAGE_DOWNLOAD_CONCURRENCY):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client = None
+        self._in_flight = set()
+        # Décodage/réduction Pillow hors du pool DB, pour ne pas bloquer les requêtes de l'API
+        self._thumbnail_executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def path_for(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash)
+
+    def register_listing_images(self, conn: sqlite3.Connection) -> int:
+        """Ajoute les URLs d'images des annonces pas encore connues (une seule fois par URL)"""
+        cursor = conn.execute(f"""
+            SELECT DISTINCT image_url FROM {LISTINGS_TABLE}
+            WHERE image_url LIKE 'http%'
+            AND image_url NOT IN (SELECT url FROM {IMAGES_TABLE})
+        """)
+        added = 0
+        while True:
+            urls = [row[0] for row in cursor.fetchmany(STREAM_BATCH_SIZE)]
+            if not urls:
+                break
+            with conn:
+                conn.executemany(f"INSERT OR IGNORE INTO {IMAGES_TABLE} (key, url) VALUES (?, ?)",
+                                 [(self.key(url), url) for url in urls])
+            added += len(urls)
+        return added
+
+    def register_records(self, conn: sqlite3.Connection, records: List[Record]):
+        """Enregistre les URLs d'images d'un lot d'annonces (dans la transaction de l'appelant)"""
+        conn.executemany(f"INSERT OR IGNORE INTO {IMAGES_TABLE} (key, url) VALUES (?, ?)",
+                         [(self.key(r.image_url), r.image_url) for r in records
+                          if r.image_url and r.image_url.startswith('http')])
+
+    def pending(self, conn: sqlite3.Connection, limit: int = 100) -> List[tuple]:
+        """Images pas encore en cache (ou évincées), hors échecs répétés"""
+        return conn.execute(f"""
+            SELECT key, url FROM {IMAGES_TABLE}
+            WHERE content_hash IS NULL AND attempts < ?
+            ORDER BY rowid LIMIT ?
+        """, (IMAGE_MAX_ATTEMPTS, limit)).fetchall()
+
+    def make_thumbnail(self, data: bytes, media_type: str) -> tuple:
+        """Réduit l'image en JPEG ; sans Pillow, l'original est conservé tel quel"""
+        pil_image = optional_import('PIL.Image')
+        if pil_image is None:
+            return data, media_type
+        with pil_image.open(io.BytesIO(data)) as img:
+            img = img.convert('RGB')
+            img.thumbnail(IMAGE_THUMBNAIL_SIZE)
+            output = io.BytesIO()
+            img.save(output, format='JPEG', quality=80, optimize=True)
+        return output.getvalue(), 'image/jpeg'
+
+    def write_thumbnail(self, data: bytes, media_type: str) -> tuple:
+        """Réduit l'image et l'écrit sur disque (adressée par son contenu) ; sans accès à la base"""
+        thumbnail, media_type = self.make_thumbnail(data, media_type)
+        content_hash = hashlib.sha256(thumbnail).hexdigest()
+        path = self.path_for(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(tmp_path, path)
+        return content_hash, len(thumbnail), media_type
+
+    def store(self, conn: sqlite3.Connection, key: str, content_hash: str, size: int, media_type: str):
+        """Rattache une miniature déjà écrite à la clé d'URL"""
+        with conn:
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {IMAGE_FILES_TABLE} (content_hash, size, media_type, last_access)
+                VALUES (?, ?, ?, ?)
+            """, (content_hash, size, media_type, time.time()))
+            conn.execute(f"UPDATE {IMAGES_TABLE} SET content_hash = ?, error = NULL WHERE key = ?",
+                         (content_hash, key))
+
+    def record_failure(self, conn: sqlite3.Connection, key: str, error: str):
+        with conn:
+            conn.execute(f"UPDATE {IMAGES_TABLE} SET attempts = attempts + 1, error = ? WHERE key = ?",
+                         (error[:200], key))
+
+    def lookup(self, conn: sqlite3.Connection, key: str) -> Optional[tuple]:
+        """Retourne (url, content_hash, media_type) ; la date d'accès n'est mise à jour que si elle est ancienne"""
+        row = conn.execute(f"""
+            SELECT i.url, f.content_hash, f.media_type, f.last_access FROM {IMAGES_TABLE} i
+            LEFT JOIN {IMAGE_FILES_TABLE} f ON f.content_hash = i.content_hash
+            WHERE i.key = ?
+        """, (key,)).fetchone()
+        if row is None:
+            return None
+
+        url, content_hash, media_type, last_access = row
+        now = time.time()
+        if content_hash and now - last_access > IMAGE_ACCESS_UPDATE_SECONDS:
+            with conn:
+                conn.execute(f"UPDATE {IMAGE_FILES_TABLE} SET last_access = ? WHERE content_hash = ?",
+                             (now, content_hash))
+        return url, content_hash, media_type
+
+    def evict(self, conn: sqlite3.Connection) -> int:
+        """Supprime les miniatures les moins récemment servies au-delà de max_bytes (jusqu'à 90 %)"""
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {IMAGE_FILES_TABLE}").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * 0.9)
+        removed = []
+        for content_hash, size in conn.execute(
+                f"SELECT content_hash, size FROM {IMAGE_FILES_TABLE} ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            try:
+                os.remove(self.path_for(content_hash))
+            except FileNotFoundError:
+                pass
+            removed.append((content_hash,))
+            total -= size
+
+        with conn:
+            conn.executemany(f"DELETE FROM {IMAGE_FILES_TABLE} WHERE content_hash = ?", removed)
+            conn.executemany(f"UPDATE {IMAGES_TABLE} SET content_hash = NULL WHERE content_hash = ?", removed)
+        logger.info(f"Cache d'images: {len(removed)} miniatures évincées")
+        return len(removed)
+
+    @property
+    def thumbnail_executor(self) -> ThreadPoolExecutor:
+        if self._thumbnail_executor is None:
+            self._thumbnail_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnails")
+        return self._thumbnail_executor
+
+    def get_client(self):
+        if self._client is None:
+            self._client = optional_import('httpx').AsyncClient(headers=HTTP_HEADERS, timeout=15, follow_redirects=True)
+        return self._client
+
+    async def fetch(self, key: str, url: str) -> bool:
+        """Télécharge une image et la stocke ; la concurrence est bornée par un sémaphore"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._in_flight.add(key)
+        try:
+            async with self._semaphore:
+                response = await self.get_client().get(url)
+                response.raise_for_status()
+            media_type = response.headers.get('content-type', 'image/jpeg').split(';')[0]
+            loop = asyncio.get_running_loop()
+            content_hash, size, media_type = await loop.run_in_executor(
+                self.thumbnail_executor, self.write_thumbnail, response.content, media_type)
+            await db.run(self.store, key, content_hash, size, media_type)
+            return True
+        except Exception as e:
+            logger.warning(f"Échec du téléchargement de l'image {url}: {e}")
+            await db.run(self.record_failure, key, str(e))
+            return False
+        finally:
+            self._in_flight.discard(key)
+
+    def schedule(self, key: str, url: str):
+        """Télécharge en arrière-plan une image déjà connue (défaut de cache lors d'une requête)
+
+        L'URL doit provenir de la table `images` : aucune URL fournie par le client
+        n'est téléchargée.
+        """
+        if key in self._in_flight or optional_import('httpx') is None:
+            return
+
+        self._in_flight.add(key)
+        asyncio.create_task(self.fetch(key, url))
+
+    async def sync(self) -> int:
+        """Enregistre les nouvelles URLs puis télécharge toutes les images manquantes"""
+        if optional_import('httpx') is None:
+            raise RuntimeError("httpx n'est pas installé : pipeline d'images indisponible")
+
+        await db.run(self.register_listing_images, timeout=120)
+        downloaded = 0
+        while True:
+            batch = [(key, url) for key, url in await db.run(self.pending)
+                     if key not in self._in_flight]
+            if not batch:
+                break
+            results = await asyncio.gather(*(self.fetch(key, url) for key, url in batch))
+            downloaded += sum(results)
+        await db.run(self.evict, timeout=120)
+        return downloaded
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._thumbnail_executor is not None:
+            self._thumbnail_executor.shutdown(wait=False)
+            self._thumbnail_executor = None
+
+image_cache = ImageCache()
+
+def dumps_json(data: Any) -> bytes:
+    """Sérialise en JSON (bytes) avec orjson si disponible"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# Taille des lots lus depuis le curseur pour les réponses en streaming
+STREAM_BATCH_SIZE = 500
+
+def iter_ndjson_rows(query: str, params: tuple = ()):
+    """Générateur NDJSON : lit le curseur par lots et sérialise chaque ligne au fil de l'eau"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield b''.join(dumps_json(dict(zip(columns, row))) + b'\n' for row in rows)
+    finally:
+        conn.close()
+
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def iter_export(categories: List[str], fmt: str, fields: List[str], min_date: Optional[str] = None,
+                max_date: Optional[str] = None, max_results: Optional[int] = None, compress: bool = False):
+    """Générateur d'export (CSV/NDJSON, gzip optionnel) en mémoire constante
+
+    Reprend les filtres de get_links.export_with_filters ; lit la table listings par lots
+    depuis un curseur de lecture dédié (une seule requête, limite par catégorie incluse).
+    """
+    indexes = [EXPORT_FIELDS.index(field) for field in fields]
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 : format gzip
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(chunk: bytes) -> bytes:
+        return compressor.compress(chunk) if compressor else chunk
+
+    if fmt == 'csv':
+        writer.writerow(fields)
+
+    conn = get_db_connection()
+    try:
+        # Une seule requête sur listings pour toutes les catégories demandées
+        query, params = build_filtered_query(categories, min_date, max_date, max_results)
+        try:
+            cursor = conn.execute(query, params)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Export impossible: {e}")
+            cursor = None
+
+        while cursor is not None:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            if fmt == 'csv':
+                for row in rows:
+                    values = format_export_row(row)
+                    writer.writerow([values[i] for i in indexes])
+                chunk = buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk = b''.join(
+                    dumps_json({field: values[i] for field, i in zip(fields, indexes)}) + b'\n'
+                    for values in (format_export_row(row) for row in rows)
+                )
+            data = encode(chunk)
+            if data:
+                yield data
+
+        if fmt == 'csv' and buffer.tell():
+            yield encode(buffer.getvalue().encode('utf-8'))
+        if compressor:
+            yield compressor.flush()
+    finally:
+        conn.close()
+
+def export_response(categories: List[str], format: str, gzip: bool, fields: Optional[str],
+                    min_date: Optional[str], max_date: Optional[str],
+                    max_results_per_category: Optional[int]) -> StreamingResponse:
+    """Valide les paramètres d'export et construit la réponse en streaming"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format invalide (csv ou ndjson)")
+
+    selected_fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(EXPORT_FIELDS)
+    unknown = [f for f in selected_fields if f not in EXPORT_FIELDS]
+    if unknown or not selected_fields:
+        raise HTTPException(status_code=400, detail=f"Champs invalides: {', '.join(unknown)}")
+
+    filename = f"{categories[0] if len(categories) == 1 else 'all'}_export.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}{".gz" if gzip else ""}"'}
+    media_type = EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        iter_export(categories, format, selected_fields, min_date, max_date,
+                    max_results_per_category, gzip),
+        media_type=media_type,
+        headers=headers,
+    )
+
 # Gestion des connexions WebSocket
 class ConnectionManager:
     def __init__(self):
@@ -180,30 +957,66 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+class RequestBudget:
+    """Budget global de requêtes (token bucket) partagé entre plusieurs crawls"""
+    def __init__(self, requests_per_minute: int):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Réserve un jeton ; bloque le thread appelant le temps nécessaire"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
 class OptimizedMubawabScraper:
-    def __init__(self, property_type: str, websocket_manager: ConnectionManager, max_workers: int = 10):
+    def __init__(self, property_type: str, websocket_manager: ConnectionManager, max_workers: int = 10,
+                 request_budget: Optional[RequestBudget] = None):
         self.property_type = property_type
         self.config = PROPERTY_CONFIGS[property_type]
         self.domain = "https://www.mubawab.ma"
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
+        self.headers = dict(HTTP_HEADERS)
         self.websocket_manager = websocket_manager
         self.max_workers = max_workers
         self.progress_queue = queue.Queue()
         self.total_new_properties = 0
         self.completed_pages = 0
+        self.request_budget = request_budget
+        self._local = threading.local()
+        self.record_type = get_record_type(property_type)
+        self.insert_sql = build_insert_sql(property_type, self.record_type)
         
         # S'assurer que la base de données existe avant de commencer
         ensure_database_exists()
 
+    @property
+    def session(self) -> 'requests.Session':
+        """Session HTTP par thread (réutilisation des connexions keep-alive)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
     def fetch_page(self, url: str) -> Optional[str]:
         """Récupère le contenu HTML d'une page avec retry logic"""
         max_retries = 3
         for attempt in range(max_retries):
             try:
                 time.sleep(0.1 + (attempt * 0.2))
-                response = requests.get(url, headers=self.headers, timeout=15)
+                if self.request_budget:
+                    self.request_budget.acquire()
+                response = self.session.get(url, timeout=15)
                 response.raise_for_status()
                 return response.text
             except Exception as e:
@@ -217,7 +1030,7 @@ class OptimizedMubawabScraper:
     def get_total_pages(self, html_content: str) -> int:
         """Calcule le nombre total de pages"""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
+            soup = parse_html(html_content)
             num_results_span = soup.find('span', id='numResults')
             if not num_results_span:
                 return 1
@@ -238,14 +1051,15 @@ class OptimizedMubawabScraper:
             logger.error(f"Erreur lors du calcul du nombre de pages: {e}")
             return 1
 
-    def parse_page(self, html_content: str) -> List[Dict]:
-        """Analyse une page et extrait les annonces"""
+    def parse_page(self, html_content: str) -> List[Record]:
+        """Analyse une page et extrait les annonces sous forme d'enregistrements compacts"""
         if not html_content:
             return []
 
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = parse_html(html_content)
         cards = soup.find_all(lambda tag: tag.name in ['li', 'div'] and 'listingBox' in tag.get('class', []))
         
+        is_terrain = self.record_type is TerrainRecord
         properties = []
         
         for card in cards:
@@ -266,20 +1080,14 @@ class OptimizedMubawabScraper:
                     if image_url != 'N/A' and image_url.startswith('/'):
                         image_url = f"{self.domain}{image_url}"
 
-                property_data = {
-                    'titre': title_tag.a.text.strip(),
-                    'lien': full_link,
-                    'prix': card.find('span', class_='priceTag').text.strip() if card.find('span', 'priceTag') else 'N/A',
-                    'localisation': card.find('span', class_='listingH3').text.strip() if card.find('span', 'listingH3') else 'N/A',
-                    'image_url': image_url,
-                    'ville': 'Marrakech'
-                }
+                price_tag = card.find('span', class_='priceTag')
+                location_tag = card.find('span', class_='listingH3')
+                titre = title_tag.a.text.strip()
+                prix = price_tag.text.strip() if price_tag else 'N/A'
+                localisation = location_tag.text.strip() if location_tag else 'N/A'
 
                 # Détails spécifiques
-                if self.property_type == 'terrains':
-                    details = {'surface': 'N/A'}
-                else:
-                    details = {'surface': 'N/A', 'pieces': 'N/A', 'chambres': 'N/A', 'salles_de_bain': 'N/A'}
+                surface = pieces = chambres = salles_de_bain = 'N/A'
 
                 details_container = card.find('div', class_='adDetails')
                 if details_container:
@@ -287,21 +1095,26 @@ class OptimizedMubawabScraper:
                     for feature in features:
                         text = feature.text.strip()
                         
-                        if self.property_type == 'terrains':
+                        if is_terrain:
                             if 'm²' in text or 'hectare' in text: 
-                                details['surface'] = text
+                                surface = text
                         else:
                             if 'm²' in text: 
-                                details['surface'] = text
+                                surface = text
                             elif 'Pièce' in text: 
-                                details['pieces'] = text
+                                pieces = text
                             elif 'Chambre' in text: 
-                                details['chambres'] = text
+                                chambres = text
                             elif 'bain' in text: 
-                                details['salles_de_bain'] = text
+                                salles_de_bain = text
 
-                property_data.update(details)
-                properties.append(property_data)
+                if is_terrain:
+                    record = TerrainRecord(titre, prix, localisation, surface,
+                                           full_link, 'Marrakech', image_url)
+                else:
+                    record = ListingRecord(titre, prix, localisation, surface, pieces, chambres,
+                                           salles_de_bain, full_link, 'Marrakech', image_url)
+                properties.append(record)
                 
             except Exception as e:
                 logger.error(f"Erreur lors de l'analyse d'une propriété: {e}")
@@ -309,52 +1122,25 @@ class OptimizedMubawabScraper:
 
         return properties
 
-    def save_properties(self, properties: List[Dict]) -> int:
+    def save_properties(self, properties: List[Record]) -> int:
         """Sauvegarde les propriétés en base de données avec thread safety"""
         if not properties:
             return 0
 
         conn = get_db_connection()  # Utiliser la nouvelle fonction
-        cursor = conn.cursor()
         new_count = 0
 
         try:
             conn.execute('BEGIN IMMEDIATE')
             
-            for prop in properties:
-                try:
-                    table_name = self.config['table_name']
-                    
-                    if self.property_type == 'terrains':
-                        sql = f'''
-                            INSERT OR IGNORE INTO {table_name} 
-                            (titre, prix, localisation, surface, lien, ville, image_url)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        '''
-                        data_tuple = (
-                            prop.get('titre'), prop.get('prix'), prop.get('localisation'),
-                            prop.get('surface'), prop.get('lien'), prop.get('ville'), prop.get('image_url')
-                        )
-                    else:
-                        sql = f'''
-                            INSERT OR IGNORE INTO {table_name} 
-                            (titre, prix, localisation, surface, pieces, chambres, salles_de_bain, 
-                             lien, ville, image_url)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        '''
-                        data_tuple = (
-                            prop.get('titre'), prop.get('prix'), prop.get('localisation'),
-                            prop.get('surface'), prop.get('pieces'), prop.get('chambres'),
-                            prop.get('salles_de_bain'), prop.get('lien'), prop.get('ville'), prop.get('image_url')
-                        )
-                    
-                    cursor.execute(sql, data_tuple)
-                    if cursor.rowcount > 0:
-                        new_count += 1
-                        
-                except sqlite3.Error as e:
-                    logger.error(f"Erreur lors de l'insertion: {e}")
-                    continue
+            # Les enregistrements sont déjà dans l'ordre des colonnes : insertion groupée
+            changes_before = conn.total_changes
+            conn.executemany(self.insert_sql, properties)
+            new_count = conn.total_changes - changes_before
+            
+            # URLs d'images connues dès l'écriture : seules celles-ci sont servies par /images
+            if IMAGE_PIPELINE_ENABLED:
+                image_cache.register_records(conn, properties)
 
             conn.commit()
             
@@ -366,10 +1152,21 @@ class OptimizedMubawabScraper:
             
         return new_count
 
+    def page_url(self, page_num: int) -> str:
+        """URL d'une page de résultats de la catégorie"""
+        return self.config['base_url'] if page_num == 1 else f"{self.config['base_url']}:p:{page_num}"
+
+    def fetch_and_save(self, page_num: int) -> Optional[int]:
+        """Télécharge, analyse et enregistre une page ; None si la page est inaccessible"""
+        html_content = self.fetch_page(self.page_url(page_num))
+        if not html_content:
+            return None
+        return self.save_properties(self.parse_page(html_content))
+
     def scrape_single_page(self, page_num: int, total_pages: int) -> Dict:
         """Scrape une seule page - utilisé par les threads"""
         try:
-            url = self.config['base_url'] if page_num == 1 else f"{self.config['base_url']}:p:{page_num}"
+            url = self.page_url(page_num)
             
             html_content = self.fetch_page(url)
             if not html_content:
@@ -522,104 +1319,1266 @@ class OptimizedMubawabScraper:
             logger.error(f"Erreur critique: {e}")
             raise e
 
+    async def scrape_incremental(self, max_pages: int = INCREMENTAL_MAX_PAGES) -> int:
+        """Crawl incrémental : pages les plus récentes d'abord, arrêt à la première page sans nouveauté"""
+        loop = asyncio.get_running_loop()
+        self.total_new_properties = 0
+        self.completed_pages = 0
+
+        for page_num in range(1, max_pages + 1):
+            new_count = await loop.run_in_executor(None, self.fetch_and_save, page_num)
+            if new_count is None:
+                logger.warning(f"Crawl incrémental {self.property_type}: page {page_num} inaccessible")
+                break
+            self.completed_pages += 1
+            self.total_new_properties += new_count
+            if new_count == 0:
+                break
+
+        await self.websocket_manager.broadcast({
+            "status": "completed",
+            "message": f"Crawl incrémental terminé! {self.total_new_properties} nouvelles propriétés ajoutées",
+            "current_page": self.completed_pages,
+            "total_pages": self.completed_pages,
+            "new_properties": 0,
+            "total_properties": self.total_new_properties
+        })
+        logger.info(f"Crawl incrémental {self.property_type}: {self.completed_pages} pages, "
+                    f"{self.total_new_properties} nouvelles propriétés")
+        return self.total_new_properties
+
+class DetailEnricher(OptimizedMubawabScraper):
+    """Deuxième étape : visite les pages d'annonces déjà en base et stocke leurs détails
+
+    Les liens sont lus par lots depuis la base (pagination par id), jamais chargés
+    en totalité ; les annonces enrichies dans la fenêtre de fraîcheur sont ignorées.
+    """
+    def __init__(self, property_type: str, websocket_manager: ConnectionManager, max_workers: int = 5,
+                 freshness_days: int = DETAILS_FRESHNESS_DAYS, batch_size: int = 50):
+        super().__init__(property_type, websocket_manager, max_workers=max_workers)
+        self.freshness_days = freshness_days
+        self.batch_size = batch_size
+
+    def fetch_pending_batch(self, after_id: int) -> List[tuple]:
+        """Lot suivant d'annonces (id, lien) sans détails ou avec des détails périmés"""
+        conn = get_db_connection()
+        try:
+            cursor = conn.execute(f"""
+                SELECT l.id, l.lien FROM {LISTINGS_TABLE} l
+                LEFT JOIN {DETAILS_TABLE} d ON d.listing_id = l.id
+                WHERE l.category = ? AND l.id > ?
+                AND (d.listing_id IS NULL OR d.date_enrichissement < datetime('now', ?))
+                ORDER BY l.id
+                LIMIT ?
+            """, (self.property_type, after_id, f'-{self.freshness_days} days', self.batch_size))
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def parse_details(self, listing_id: int, html_content: str) -> Optional[DetailRecord]:
+        """Extrait description, coordonnées et équipements d'une page d'annonce"""
+        if not html_content:
+            return None
+
+        soup = parse_html(html_content)
+
+        description = None
+        description_block = soup.find('div', class_='blockProp')
+        if description_block and description_block.find('p'):
+            description = ' '.join(description_block.find('p').text.split())
+        else:
+            meta = soup.find('meta', attrs={'name': 'description'})
+            if meta and meta.get('content'):
+                description = meta['content'].strip()
+
+        latitude = longitude = None
+        map_tag = (soup.find(attrs={'lat': True, 'lon': True}) or
+                   soup.find(attrs={'data-lat': True, 'data-lon': True}))
+        if map_tag:
+            try:
+                latitude = float(map_tag.get('lat') or map_tag.get('data-lat'))
+                longitude = float(map_tag.get('lon') or map_tag.get('data-lon'))
+            except (TypeError, ValueError):
+                latitude = longitude = None
+
+        amenities = []
+        for feature in soup.find_all(class_=['adFeature', 'characIconText']):
+            text = ' '.join(feature.text.split())
+            if text and text not in amenities:
+                amenities.append(text)
+
+        return DetailRecord(listing_id, description, latitude, longitude,
+                            json.dumps(amenities, ensure_ascii=False))
+
+    def enrich_listing(self, listing_id: int, lien: str) -> Optional[DetailRecord]:
+        """Télécharge et analyse une page d'annonce - utilisé par les threads"""
+        try:
+            return self.parse_details(listing_id, self.fetch_page(lien))
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enrichissement de {lien}: {e}")
+            return None
+
+    def save_details(self, details: List[DetailRecord]) -> int:
+        """Enregistre (ou rafraîchit) les détails d'un lot d'annonces"""
+        if not details:
+            return 0
+
+        conn = get_db_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(f"""
+                INSERT OR REPLACE INTO {DETAILS_TABLE}
+                (listing_id, description, latitude, longitude, amenities, date_enrichissement)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, details)
+            conn.commit()
+            return len(details)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Erreur lors de la sauvegarde des détails: {e}")
+            return 0
+        finally:
+            conn.close()
+
+    async def enrich_with_progress(self, max_listings: Optional[int] = None) -> int:
+        """Enrichit les annonces par lots avec au plus max_workers requêtes simultanées"""
+        loop = asyncio.get_running_loop()
+        enriched = 0
+        processed = 0
+        last_id = 0
+
+        await self.websocket_manager.broadcast({
+            "status": "starting",
+            "message": f"Enrichissement des annonces ({self.property_type})...",
+            "current_page": 0,
+            "total_pages": 0,
+            "new_properties": 0,
+            "total_properties": 0
+        })
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while max_listings is None or processed < max_listings:
+                batch = await loop.run_in_executor(executor, self.fetch_pending_batch, last_id)
+                if max_listings is not None:
+                    batch = batch[:max_listings - processed]
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                processed += len(batch)
+
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(executor, self.enrich_listing, listing_id, lien)
+                    for listing_id, lien in batch
+                ))
+                saved = await loop.run_in_executor(
+                    executor, self.save_details, [r for r in results if r is not None]
+                )
+                enriched += saved
+
+                await self.websocket_manager.broadcast({
+                    "status": "progress",
+                    "message": f"{processed} annonces traitées - {enriched} enrichies",
+                    "current_page": processed,
+                    "total_pages": max_listings or 0,
+                    "new_properties": saved,
+                    "total_properties": enriched
+                })
+
+        await self.websocket_manager.broadcast({
+            "status": "completed",
+            "message": f"Enrichissement terminé! {enriched} annonces enrichies",
+            "current_page": processed,
+            "total_pages": processed,
+            "new_properties": 0,
+            "total_properties": enriched
+        })
+        logger.info(f"Enrichissement {self.property_type}: {enriched}/{processed} annonces enrichies")
+        return enriched
+
+class CrawlQueue:
+    """File de tâches (catégorie, page) stockée dans SQLite, partagée par plusieurs workers
+
+    Une tâche est louée (lease) par un worker pour une durée limitée, prolongée par
+    heartbeat ; une tâche dont le bail a expiré redevient disponible, dans la limite
+    de TASK_MAX_ATTEMPTS tentatives.
+    """
+    def __init__(self, lease_seconds: int = TASK_LEASE_SECONDS, max_attempts: int = TASK_MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, property_type: str, pages: List[int], crawl_id: Optional[str] = None) -> str:
+        """Ajoute les pages d'une catégorie à la file et retourne l'identifiant du crawl"""
+        crawl_id = crawl_id or uuid.uuid4().hex
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.executemany(f"""
+                    INSERT OR IGNORE INTO {CRAWL_TASKS_TABLE} (crawl_id, category, page_num)
+                    VALUES (?, ?, ?)
+                """, [(crawl_id, property_type, page_num) for page_num in pages])
+        finally:
+            conn.close()
+        return crawl_id
+
+    def lease(self, worker_id: str) -> Optional[tuple]:
+        """Réserve la prochaine tâche disponible : (id, category, page_num) ou None"""
+        now = time.time()
+        conn = get_db_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Bail expiré sur la dernière tentative : la tâche est abandonnée
+            conn.execute(f"""
+                UPDATE {CRAWL_TASKS_TABLE} SET status = 'failed', error = 'lease expired'
+                WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+            """, (now, self.max_attempts))
+            row = conn.execute(f"""
+                SELECT id, category, page_num FROM {CRAWL_TASKS_TABLE}
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?))
+                AND attempts < ?
+                ORDER BY id
+                LIMIT 1
+            """, (now, self.max_attempts)).fetchone()
+            if row:
+                conn.execute(f"""
+                    UPDATE {CRAWL_TASKS_TABLE}
+                    SET status = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                    WHERE id = ?
+                """, (worker_id, now + self.lease_seconds, row[0]))
+            conn.commit()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, task_id: int, worker_id: str) -> bool:
+        """Prolonge le bail ; False si la tâche a été reprise par un autre worker"""
+        conn = get_db_connection()
+        try:
+            with conn:
+                cursor = conn.execute(f"""
+                    UPDATE {CRAWL_TASKS_TABLE} SET lease_expires_at = ?
+                    WHERE id = ? AND lease_owner = ? AND status = 'leased'
+                """, (time.time() + self.lease_seconds, task_id, worker_id))
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def complete(self, task_id: int, worker_id: str, new_count: int):
+        """Marque une tâche comme terminée"""
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute(f"""
+                    UPDATE {CRAWL_TASKS_TABLE}
+                    SET status = 'done', new_count = ?, lease_expires_at = NULL, error = NULL
+                    WHERE id = ? AND lease_owner = ?
+                """, (new_count, task_id, worker_id))
+        finally:
+            conn.close()
+
+    def fail(self, task_id: int, worker_id: str, error: str):
+        """Remet la tâche en attente, ou l'abandonne après max_attempts tentatives"""
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute(f"""
+                    UPDATE {CRAWL_TASKS_TABLE}
+                    SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                        lease_expires_at = NULL, error = ?
+                    WHERE id = ? AND lease_owner = ?
+                """, (self.max_attempts, error, task_id, worker_id))
+        finally:
+            conn.close()
+
+    def status(self, conn: sqlite3.Connection, crawl_id: str) -> Dict[str, Any]:
+        """Avancement d'un crawl : nombre de tâches par statut et nouvelles annonces"""
+        rows = conn.execute(f"""
+            SELECT status, COUNT(*), SUM(new_count) FROM {CRAWL_TASKS_TABLE}
+            WHERE crawl_id = ? GROUP BY status
+        """, (crawl_id,)).fetchall()
+        return {
+            "crawl_id": crawl_id,
+            "tasks": {status: count for status, count, _ in rows},
+            "total_tasks": sum(count for _, count, _ in rows),
+            "new_properties": sum(new or 0 for _, _, new in rows)
+        }
+
+class CrawlWorker:
+    """Worker qui consomme la file partagée ; plusieurs processus/machines peuvent tourner en parallèle"""
+    def __init__(self, crawl_queue: CrawlQueue, worker_id: Optional[str] = None, idle_sleep: float = 5.0):
+        self.queue = crawl_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.idle_sleep = idle_sleep
+        self.scrapers: Dict[str, OptimizedMubawabScraper] = {}
+        self.stop_event = threading.Event()
+
+    def get_scraper(self, property_type: str) -> OptimizedMubawabScraper:
+        if property_type not in self.scrapers:
+            self.scrapers[property_type] = OptimizedMubawabScraper(property_type, manager, max_workers=1)
+        return self.scrapers[property_type]
+
+    def process_task(self, task_id: int, property_type: str, page_num: int):
+        """Scrape une page louée en maintenant le bail par heartbeat"""
+        done = threading.Event()
+
+        def keep_alive():
+            while not done.wait(TASK_HEARTBEAT_SECONDS):
+                if not self.queue.heartbeat(task_id, self.worker_id):
+                    logger.warning(f"Bail perdu pour la tâche {task_id}")
+                    return
+
+        heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat_thread.start()
+        try:
+            new_count = self.get_scraper(property_type).fetch_and_save(page_num)
+            if new_count is None:
+                raise Exception("Failed to fetch page")
+            self.queue.complete(task_id, self.worker_id, new_count)
+            logger.info(f"[{self.worker_id}] {property_type} page {page_num}: {new_count} nouvelles propriétés")
+        except Exception as e:
+            logger.error(f"[{self.worker_id}] Échec {property_type} page {page_num}: {e}")
+            self.queue.fail(task_id, self.worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+    def run(self, exit_when_idle: bool = False):
+        """Boucle principale : louer, traiter, recommencer"""
+        while not self.stop_event.is_set():
+            task = self.queue.lease(self.worker_id)
+            if task is None:
+                if exit_when_idle:
+                    return
+                self.stop_event.wait(self.idle_sleep)
+                continue
+            self.process_task(*task)
+
+def run_workers(threads: int = 4, exit_when_idle: bool = False):
+    """Lance plusieurs workers dans ce processus (mode `python main.py worker`)"""
+    ensure_database_exists()
+    crawl_queue = CrawlQueue()
+    workers = [CrawlWorker(crawl_queue) for _ in range(threads)]
+    logger.info(f"Démarrage de {threads} workers: {', '.join(w.worker_id for w in workers)}")
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for future in [executor.submit(worker.run, exit_when_idle) for worker in workers]:
+                future.result()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.stop_event.set()
+
+crawl_queue = CrawlQueue()
+
+def enqueue_crawl(property_type: str, max_pages: Optional[int] = None) -> Dict[str, Any]:
+    """Calcule le nombre de pages d'une catégorie et les place dans la file partagée"""
+    scraper = OptimizedMubawabScraper(property_type, manager, max_workers=1)
+    first_page_html = scraper.fetch_page(scraper.config['base_url'])
+    if not first_page_html:
+        raise Exception("Impossible de charger la première page")
+
+    total_pages = scraper.get_total_pages(first_page_html)
+    if max_pages:
+        total_pages = min(total_pages, max_pages)
+
+    crawl_id = crawl_queue.enqueue(property_type, list(range(1, total_pages + 1)))
+    return {"crawl_id": crawl_id, "property_type": property_type, "total_pages": total_pages}
+
+def start_run(conn: sqlite3.Connection, category: str, trigger: str, mode: str,
+              status: str = 'running', owner: Optional[str] = None) -> int:
+    """Enregistre le début (ou le saut) d'un crawl et retourne son id"""
+    with conn:
+        cursor = conn.execute(f"""
+            INSERT INTO {CRAWL_RUNS_TABLE} (category, trigger, mode, status, owner, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (category, trigger, mode, status, owner, time.time()))
+    return cursor.lastrowid
+
+def heartbeat_run(conn: sqlite3.Connection, run_id: int):
+    with conn:
+        conn.execute(f"UPDATE {CRAWL_RUNS_TABLE} SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                     (time.time(), run_id))
+
+def finish_run(conn: sqlite3.Connection, run_id: int, status: str, duration: float,
+               pages: int, new_properties: int, error: Optional[str] = None):
+    with conn:
+        conn.execute(f"""
+            UPDATE {CRAWL_RUNS_TABLE}
+            SET status = ?, finished_at = CURRENT_TIMESTAMP, duration_seconds = ?, pages = ?,
+                new_properties = ?, error = ?
+            WHERE id = ?
+        """, (status, round(duration, 2), pages, new_properties, error, run_id))
+
+def close_interrupted_runs(conn: sqlite3.Connection, stale_seconds: int = RUN_STALE_SECONDS) -> int:
+    """Marque comme échoués les crawls « running » dont le processus ne donne plus de heartbeat
+
+    Les crawls d'autres processus encore actifs (heartbeat récent) ne sont pas touchés.
+    """
+    with conn:
+        cursor = conn.execute(f"""
+            UPDATE {CRAWL_RUNS_TABLE} SET status = 'failed', error = 'interrupted'
+            WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        """, (time.time() - stale_seconds,))
+    return cursor.rowcount
+
+def acquire_scheduler_lease(conn: sqlite3.Connection, owner: str,
+                            lease_seconds: int = SCHEDULER_LEASE_SECONDS) -> bool:
+    """Prend ou renouvelle le bail du planificateur ; False s'il est tenu par un autre processus"""
+    now = time.time()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(f"SELECT owner, expires_at FROM {SCHEDULER_LEASE_TABLE} WHERE name = 'scheduler'"
+                           ).fetchone()
+        acquired = row is None or row[0] == owner or row[1] < now
+        if acquired:
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {SCHEDULER_LEASE_TABLE} (name, owner, expires_at)
+                VALUES ('scheduler', ?, ?)
+            """, (owner, now + lease_seconds))
+        conn.commit()
+        return acquired
+    except Exception:
+        conn.rollback()
+        raise
+
+def release_scheduler_lease(conn: sqlite3.Connection, owner: str):
+    with conn:
+        conn.execute(f"DELETE FROM {SCHEDULER_LEASE_TABLE} WHERE name = 'scheduler' AND owner = ?", (owner,))
+
+def running_categories(conn: sqlite3.Connection, enrichment: bool = False,
+                       stale_seconds: int = RUN_STALE_SECONDS) -> set:
+    """Catégories ayant un crawl (ou un enrichissement) « running » au heartbeat récent, tous processus"""
+    rows = conn.execute(f"""
+        SELECT DISTINCT category FROM {CRAWL_RUNS_TABLE}
+        WHERE status = 'running' AND heartbeat_at >= ? AND (mode = 'enrich') = ?
+    """, (time.time() - stale_seconds, enrichment)).fetchall()
+    return {category for category, in rows}
+
+def schedule_state(conn: sqlite3.Connection, default_intervals: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+    """Intervalle, activation et dernier démarrage (epoch) de chaque catégorie planifiable
+
+    Les catégories absentes de la table gardent l'intervalle par défaut ; le dernier
+    démarrage inclut les échéances « skipped » pour ne pas les rejouer à chaque tick.
+    """
+    stored = {category: (interval_minutes, bool(enabled)) for category, interval_minutes, enabled
+              in conn.execute(f"SELECT category, interval_minutes, enabled FROM {CRAWL_SCHEDULE_TABLE}")}
+    last_runs = dict(conn.execute(f"""
+        SELECT category, CAST(strftime('%s', MAX(started_at)) AS INTEGER)
+        FROM {CRAWL_RUNS_TABLE} WHERE mode != 'enrich' GROUP BY category
+    """).fetchall())
+    state = {}
+    for category, default_interval in default_intervals.items():
+        interval_minutes, enabled = stored.get(category, (default_interval, True))
+        last_run = last_runs.get(category)
+        state[category] = {
+            "interval_minutes": interval_minutes,
+            "enabled": enabled,
+            "last_run": last_run,
+            # Jamais crawlée : due dès le prochain tick
+            "next_run": last_run + interval_minutes * 60 if last_run else None
+        }
+    return state
+
+def save_schedule(conn: sqlite3.Connection, category: str, default_interval: int,
+                  interval_minutes: Optional[int] = None, enabled: Optional[bool] = None):
+    with conn:
+        conn.execute(f"""
+            INSERT OR IGNORE INTO {CRAWL_SCHEDULE_TABLE} (category, interval_minutes, enabled)
+            VALUES (?, ?, 1)
+        """, (category, default_interval))
+        if interval_minutes is not None:
+            conn.execute(f"UPDATE {CRAWL_SCHEDULE_TABLE} SET interval_minutes = ? WHERE category = ?",
+                         (interval_minutes, category))
+        if enabled is not None:
+            conn.execute(f"UPDATE {CRAWL_SCHEDULE_TABLE} SET enabled = ? WHERE category = ?",
+                         (int(enabled), category))
+
+def has_recent_data(conn: sqlite3.Connection, category: str) -> bool:
+    """Vrai si la catégorie contient des annonces récupérées dans la fenêtre incrémentale"""
+    row = conn.execute(f"""
+        SELECT 1 FROM {LISTINGS_TABLE}
+        WHERE category = ? AND date_scraping >= datetime('now', ?)
+        LIMIT 1
+    """, (category, f'-{INCREMENTAL_WINDOW_HOURS} hours')).fetchone()
+    return row is not None
+
+def list_runs(conn: sqlite3.Connection, category: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    query = f"SELECT * FROM {CRAWL_RUNS_TABLE}"
+    params: List[Any] = []
+    if category:
+        query += " WHERE category = ?"
+        params.append(category)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+class CrawlScheduler:
+    """Planificateur de crawls récurrents exécuté dans la boucle de l'API
+
+    Chaque catégorie a son intervalle (table crawl_schedule) et son échéance est calculée
+    depuis son dernier crawl enregistré ; les démarrages sont espacés et tous les crawls
+    planifiés partagent un même budget de requêtes. Un crawl encore en cours pour la
+    catégorie fait sauter l'échéance (enregistrée « skipped »). Quand plusieurs processus
+    partagent la base, seul le détenteur du bail SQLite planifie.
+    """
+    def __init__(self, intervals: Optional[Dict[str, int]] = None,
+                 requests_per_minute: int = SCHEDULER_REQUESTS_PER_MINUTE,
+                 stagger_seconds: int = SCHEDULER_STAGGER_SECONDS):
+        # Intervalles par défaut des catégories planifiables, remplacés par ceux de crawl_schedule
+        self.intervals = intervals or {category: DEFAULT_CRAWL_INTERVAL_MINUTES for category in PROPERTY_CONFIGS}
+        self.budget = RequestBudget(requests_per_minute)
+        self.stagger_seconds = stagger_seconds
+        self.lease_seconds = max(SCHEDULER_LEASE_SECONDS, 2 * (stagger_seconds + SCHEDULER_TICK_SECONDS))
+        self.running: Dict[str, asyncio.Task] = {}
+        self.enriching: Dict[str, asyncio.Task] = {}
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def is_running_locally(self, category: str) -> bool:
+        task = self.running.get(category)
+        return task is not None and not task.done()
+
+    async def is_running(self, category: str) -> bool:
+        """Crawl en cours dans ce processus (même avant son enregistrement) ou dans un autre"""
+        return self.is_running_locally(category) or category in await db.run(running_categories)
+
+    async def heartbeat(self, run_id: int):
+        """Signale périodiquement qu'un run de ce processus est toujours actif"""
+        while True:
+            await asyncio.sleep(RUN_HEARTBEAT_SECONDS)
+            try:
+                await db.run(heartbeat_run, run_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat du crawl {run_id} impossible: {e}")
+
+    async def run_crawl(self, category: str, trigger: str, mode: Optional[str] = None,
+                        max_pages: Optional[int] = None) -> int:
+        """Exécute un crawl en l'historisant, puis met à jour doublons, agrégats et images
+
+        Le run est clos dès la fin du scraping ; les post-traitements sont journalisés à part.
+        """
+        if mode is None:
+            mode = 'incremental' if await db.run(has_recent_data, category) else 'full'
+
+        if trigger == 'schedule':
+            scraper = OptimizedMubawabScraper(category, manager, max_workers=SCHEDULED_MAX_WORKERS,
+                                              request_budget=self.budget)
+        else:
+            scraper = OptimizedMubawabScraper(category, manager, max_workers=10)
+
+        run_id = await db.run(start_run, category, trigger, mode, 'running', self.owner)
+        started = time.monotonic()
+        heartbeat_task = asyncio.create_task(self.heartbeat(run_id))
+        try:
+            if mode == 'incremental':
+                new_properties = await scraper.scrape_incremental(max_pages or INCREMENTAL_MAX_PAGES)
+            else:
+                new_properties = await scraper.scrape_with_progress(max_pages)
+        except Exception as e:
+            await db.run(finish_run, run_id, 'failed', time.monotonic() - started,
+                         scraper.completed_pages, scraper.total_new_properties, str(e))
+            raise
+        finally:
+            heartbeat_task.cancel()
+        await db.run(finish_run, run_id, 'completed', time.monotonic() - started,
+                     scraper.completed_pages, new_properties)
+
+        # Post-traitements : une erreur ici ne remet pas en cause le crawl déjà historisé
+        try:
+            await maintenance_db.run(duplicate_detector.update)
+            await maintenance_db.run(rollup_builder.update)
+            if IMAGE_PIPELINE_ENABLED:
+                await image_cache.sync()
+        except Exception as e:
+            logger.error(f"Erreur des post-traitements après le crawl de {category}: {e}")
+        return new_properties
+
+    def launch(self, category: str, trigger: str, mode: Optional[str] = None,
+               max_pages: Optional[int] = None) -> asyncio.Task:
+        """Démarre un crawl en tâche de fond et l'enregistre comme en cours"""
+        async def background_crawl():
+            try:
+                await self.run_crawl(category, trigger, mode, max_pages)
+            except Exception as e:
+                logger.error(f"Erreur durant le crawl {trigger} de {category}: {e}")
+
+        task = asyncio.create_task(background_crawl())
+        self.running[category] = task
+        return task
+
+    async def enriching_categories(self, categories: List[str]) -> List[str]:
+        """Catégories parmi celles demandées dont l'enrichissement tourne déjà (ici ou ailleurs)"""
+        running = await db.run(running_categories, True)
+        # Tâches locales vérifiées après la requête, sans await avant l'enregistrement du lancement
+        return [category for category in categories
+                if category in running or (category in self.enriching and not self.enriching[category].done())]
+
+    async def run_enrichment(self, category: str, freshness_days: int, max_listings: Optional[int]) -> int:
+        """Enrichit une catégorie en historisant le run (mode « enrich ») dans crawl_runs"""
+        enricher = DetailEnricher(category, manager, freshness_days=freshness_days)
+        run_id = await db.run(start_run, category, 'manual', 'enrich', 'running', self.owner)
+        started = time.monotonic()
+        heartbeat_task = asyncio.create_task(self.heartbeat(run_id))
+        try:
+            enriched = await enricher.enrich_with_progress(max_listings)
+        except Exception as e:
+            await db.run(finish_run, run_id, 'failed', time.monotonic() - started, None, None, str(e))
+            raise
+        finally:
+            heartbeat_task.cancel()
+        await db.run(finish_run, run_id, 'completed', time.monotonic() - started, None, enriched)
+        return enriched
+
+    def launch_enrichment(self, categories: List[str], freshness_days: int,
+                          max_listings: Optional[int]) -> asyncio.Task:
+        """Enrichit les catégories l'une après l'autre en tâche de fond"""
+        async def background_enrich():
+            for category in categories:
+                try:
+                    await self.run_enrichment(category, freshness_days, max_listings)
+                except Exception as e:
+                    logger.error(f"Erreur durant l'enrichissement de {category}: {e}")
+
+        task = asyncio.create_task(background_enrich())
+        for category in categories:
+            self.enriching[category] = task
+        return task
+
+    async def hold_lease(self) -> bool:
+        """Renouvelle le bail du planificateur et journalise les changements de détenteur"""
+        leader = await db.run(acquire_scheduler_lease, self.owner, self.lease_seconds)
+        if leader != self.leader:
+            logger.info(f"Planificateur: bail {'acquis' if leader else 'perdu'} ({self.owner})")
+            self.leader = leader
+        return leader
+
+    async def tick(self):
+        """Lance les crawls arrivés à échéance, espacés de stagger_seconds"""
+        now = time.time()
+        state = await db.run(schedule_state, self.intervals)
+        due = [category for category, entry in state.items() if entry["enabled"] and (entry["next_run"] or 0) <= now]
+        launched = False
+        for category in due:
+            if launched:
+                await asyncio.sleep(self.stagger_seconds)
+                if not await self.hold_lease():
+                    return
+            # Vérifié après l'attente : un crawl manuel a pu démarrer entre-temps
+            if await self.is_running(category):
+                logger.info(f"Planificateur: {category} encore en cours, échéance ignorée")
+                await db.run(start_run, category, 'schedule', 'none', 'skipped', self.owner)
+                continue
+            self.launch(category, 'schedule')
+            launched = True
+
+    async def loop(self):
+        while True:
+            try:
+                if await self.hold_lease():
+                    await db.run(close_interrupted_runs)
+                    await self.tick()
+            except Exception as e:
+                logger.error(f"Erreur du planificateur: {e}")
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.loop())
+            logger.info("Planificateur de crawls démarré")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.leader:
+                await db.run(release_scheduler_lease, self.owner)
+                self.leader = False
+
+    async def describe(self) -> Dict[str, Any]:
+        state = await db.run(schedule_state, self.intervals)
+        running = await db.run(running_categories)
+        return {
+            "enabled": self._task is not None,
+            "leader": self.leader,
+            "requests_per_minute": round(self.budget.rate * 60),
+            "categories": {
+                category: {
+                    "interval_minutes": entry["interval_minutes"],
+                    "enabled": entry["enabled"],
+                    "running": self.is_running_locally(category) or category in running,
+                    "last_run": (datetime.fromtimestamp(entry["last_run"]).isoformat()
+                                 if entry["last_run"] else None),
+                    "next_run": (datetime.fromtimestamp(entry["next_run"]).isoformat()
+                                 if entry["next_run"] else None)
+                }
+                for category, entry in state.items()
+            }
+        }
+
+scheduler = CrawlScheduler()
+
+# Temps de démarrage (import du module puis initialisation du schéma), en ms
+STARTUP_STATS: Dict[str, float] = {}
+
+def parse_price(text: Optional[str]) -> Optional[int]:
+    """Prix affiché ("1 200 000 DH") en entier ; None pour "Prix à consulter" et assimilés"""
+    match = re.match(r'[\d.,]*\d', re.sub(r'\s', '', text or ''))
+    return int(re.sub(r'\D', '', match.group())) if match else None
+
+def parse_surface(text: Optional[str]) -> Optional[int]:
+    """Surface affichée en m² entiers (les hectares sont convertis)"""
+    match = re.match(r'\d+(?:[.,]\d+)?', re.sub(r'\s', '', text or ''))
+    if not match:
+        return None
+    value = float(match.group().replace(',', '.'))
+    if 'hectare' in text.lower():
+        value *= 10000
+    return int(value)
+
+class DuplicateDetector:
+    """Regroupe les annonces quasi identiques (toutes catégories) en clusters
+
+    Chaque annonce est réduite à un ensemble de traits normalisés (mots et bigrammes
+    du titre, prix, surface, localisation, image) puis à une signature MinHash ; le
+    LSH par bandes ne compare une annonce qu'aux candidates partageant un bucket.
+    Le traitement est incrémental : seules les annonces sans signature sont calculées.
+    """
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, bands: int = LSH_BANDS,
+                 threshold: float = DUPLICATE_THRESHOLD, min_features: int = DUPLICATE_MIN_FEATURES):
+        if num_perm % 16 or num_perm % bands:
+            raise ValueError("num_perm doit être un multiple de 16 et de bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.min_features = min_features
+        # Un condensé blake2b de 64 octets fournit 16 valeurs de hachage 32 bits
+        self.salts = [struct.pack('<I', i) for i in range(num_perm // 16)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: Optional[str]) -> str:
+        if not text or text == 'N/A':
+            return ''
+        text = unicodedata.normalize('NFKD', text.lower())
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+    def numeric_values(self, prix: str, surface: str) -> tuple:
+        """(prix, surface) en entiers, None si absents"""
+        return parse_price(prix), parse_surface(surface)
+
+    def features(self, titre: str, prix: str, surface: str, localisation: str, image_url: str) -> set:
+        """Ensemble de traits normalisés d'une annonce"""
+        words = self.normalize(titre).split()
+        features = {f"t:{w}" for w in words}
+        features.update(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+
+        price, surface_value = self.numeric_values(prix, surface)
+        if price:
+            features.add(f"p:{price}")
+        if surface_value:
+            features.add(f"s:{surface_value}")
+        location = self.normalize(localisation)
+        if location:
+            features.add(f"l:{location}")
+        if image_url and image_url.startswith('http'):
+            features.add(f"i:{image_url}")
+        return features
+
+    def signature(self, features: set) -> tuple:
+        """Signature MinHash : minimum colonne par colonne des hachages de chaque trait"""
+        hashed = []
+        for feature in features:
+            encoded = feature.encode('utf-8')
+            values = ()
+            for salt in self.salts:
+                values += struct.unpack('<16I', hashlib.blake2b(encoded, digest_size=64, salt=salt).digest())
+            hashed.append(values)
+        if not hashed:
+            return (0,) * self.num_perm
+        return tuple(min(column) for column in zip(*hashed))
+
+    def band_buckets(self, signature: tuple) -> List[tuple]:
+        """(bande, bucket) pour chaque bande de la signature"""
+        buckets = []
+        for band in range(self.bands):
+            chunk = struct.pack(f'<{self.rows}I', *signature[band * self.rows:(band + 1) * self.rows])
+            bucket = int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True)
+            buckets.append((band, bucket))
+        return buckets
+
+    def similarity(self, sig_a: tuple, sig_b: tuple) -> float:
+        """Estimation de la similarité de Jaccard"""
+        return sum(a == b for a, b in zip(sig_a, sig_b)) / self.num_perm
+
+    @staticmethod
+    def compatible(a: Optional[int], b: Optional[int]) -> bool:
+        """Deux valeurs connues doivent être proches ; une valeur manquante ne contredit rien"""
+        if not a or not b:
+            return True
+        return abs(a - b) <= DUPLICATE_NUMERIC_TOLERANCE * max(a, b)
+
+    def process_batch(self, conn: sqlite3.Connection, rows: List[tuple]) -> int:
+        """Signe un lot d'annonces et les rattache aux clusters ; retourne le nombre de fusions"""
+        merged = 0
+        sig_format = f'<{self.num_perm}I'
+        band_query = ' OR '.join(['(h.band = ? AND h.bucket = ?)'] * self.bands)
+
+        for listing_id, titre, prix, surface, localisation, image_url in rows:
+            features = self.features(titre, prix, surface, localisation, image_url)
+            signature = self.signature(features)
+            price, surface_value = self.numeric_values(prix, surface)
+            # Annonce quasi vide : signée mais laissée seule dans son cluster et hors LSH,
+            # sinon toutes les annonces vides partageraient les mêmes buckets
+            buckets = self.band_buckets(signature) if len(features) >= self.min_features else []
+
+            candidates = conn.execute(f"""
+                SELECT DISTINCT s.listing_id, s.signature, s.price, s.surface, s.cluster_id
+                FROM {LSH_TABLE} h
+                JOIN {SIGNATURES_TABLE} s ON s.listing_id = h.listing_id
+                WHERE {band_query}
+            """, [value for bucket in buckets for value in bucket]).fetchall() if buckets else []
+
+            # Vérification des candidats : similarité MinHash puis prix/surface cohérents
+            clusters = {cluster_id for _, candidate_sig, candidate_price, candidate_surface, cluster_id
+                        in candidates
+                        if self.compatible(price, candidate_price)
+                        and self.compatible(surface_value, candidate_surface)
+                        and self.similarity(signature, struct.unpack(sig_format, candidate_sig)) >= self.threshold}
+            cluster_id = min(clusters) if clusters else listing_id
+
+            # Fusion des clusters reliés par la nouvelle annonce
+            others = [c for c in clusters if c != cluster_id]
+            if others:
+                conn.execute(f"""
+                    UPDATE {SIGNATURES_TABLE} SET cluster_id = ?
+                    WHERE cluster_id IN ({', '.join('?' * len(others))})
+                """, [cluster_id] + others)
+                merged += len(others)
+
+            conn.execute(f"""
+                INSERT INTO {SIGNATURES_TABLE} (listing_id, signature, price, surface, cluster_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (listing_id, struct.pack(sig_format, *signature), price, surface_value, cluster_id))
+            conn.executemany(f"INSERT INTO {LSH_TABLE} (band, bucket, listing_id) VALUES (?, ?, ?)",
+                             [(band, bucket, listing_id) for band, bucket in buckets])
+        return merged
+
+    def update(self, conn: sqlite3.Connection, batch_size: int = STREAM_BATCH_SIZE) -> Dict[str, int]:
+        """Calcule les signatures des nouvelles annonces et met à jour les clusters"""
+        processed = 0
+        merged = 0
+
+        # Un seul passage à la fois dans ce processus ; BEGIN IMMEDIATE couvre la sélection
+        # des annonces sans signature et leur insertion face aux autres processus
+        with self._lock:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    rows = conn.execute(f"""
+                        SELECT l.id, l.titre, l.prix, l.surface, l.localisation, l.image_url
+                        FROM {LISTINGS_TABLE} l
+                        LEFT JOIN {SIGNATURES_TABLE} s ON s.listing_id = l.id
+                        WHERE s.listing_id IS NULL
+                        ORDER BY l.id
+                        LIMIT ?
+                    """, (batch_size,)).fetchall()
+                    merged += self.process_batch(conn, rows)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                if not rows:
+                    break
+                processed += len(rows)
+
+        if processed:
+            logger.info(f"Dédoublonnage: {processed} annonces traitées, {merged} fusions de clusters")
+        return {"processed": processed, "merged": merged}
+
+    def clusters(self, conn: sqlite3.Connection, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """Clusters contenant au moins deux annonces, les plus grands d'abord"""
+        cluster_rows = conn.execute(f"""
+            SELECT cluster_id, COUNT(*) AS size FROM {SIGNATURES_TABLE}
+            GROUP BY cluster_id HAVING size > 1
+            ORDER BY size DESC, cluster_id
+            LIMIT ? OFFSET ?
+        """, (limit, offset)).fetchall()
+
+        result = []
+        for cluster_id, size in cluster_rows:
+            members = conn.execute(f"""
+                SELECT l.id, l.category, l.titre, l.prix, l.lien FROM {SIGNATURES_TABLE} s
+                JOIN {LISTINGS_TABLE} l ON l.id = s.listing_id
+                WHERE s.cluster_id = ?
+                ORDER BY l.id
+            """, (cluster_id,)).fetchall()
+            result.append({
+                "cluster_id": cluster_id,
+                "size": size,
+                "listings": [dict(zip(("id", "category", "titre", "prix", "lien"), member)) for member in members]
+            })
+        return result
+
+    def summary(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """Nombre d'annonces analysées et d'annonces distinctes (un représentant par cluster)"""
+        total, unique = conn.execute(
+            f"SELECT COUNT(*), COUNT(DISTINCT cluster_id) FROM {SIGNATURES_TABLE}").fetchone()
+        return {"listings": total, "unique_listings": unique, "duplicates": total - unique}
+
+duplicate_detector = DuplicateDetector()
+
+class RollupBuilder:
+    """Agrégats par catégorie, localisation et jour (nombre, prix min/médian/max, prix au m²)
+
+    Après chaque crawl, seuls les groupes touchés par les annonces ajoutées depuis
+    le dernier passage (id > dernier id traité) sont recalculés.
+    """
+    state_name = 'listings'
+
+    def group_stats(self, rows: List[tuple]) -> tuple:
+        """(nombre, nombre avec prix, min, médiane, max, médiane du prix au m²)"""
+        prices = []
+        prices_m2 = []
+        for prix, surface in rows:
+            price = parse_price(prix)
+            if price is None:
+                continue
+            prices.append(price)
+            surface_value = parse_surface(surface)
+            if surface_value:
+                prices_m2.append(price / surface_value)
+        return (
+            len(rows), len(prices),
+            min(prices) if prices else None,
+            statistics.median(prices) if prices else None,
+            max(prices) if prices else None,
+            round(statistics.median(prices_m2), 2) if prices_m2 else None,
+        )
+
+    def refresh_group(self, conn: sqlite3.Connection, category: str, localisation: str, day: str):
+        rows = conn.execute(f"""
+            SELECT prix, surface FROM {LISTINGS_TABLE}
+            WHERE category = ? AND date_scraping >= ? AND date_scraping < date(?, '+1 day')
+            AND COALESCE(localisation, 'N/A') = ?
+        """, (category, day, day, localisation)).fetchall()
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {ROLLUPS_TABLE}
+            (category, localisation, day, listing_count, priced_count, min_price, median_price,
+             max_price, median_price_m2, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (category, localisation, day) + self.group_stats(rows))
+
+    def update(self, conn: sqlite3.Connection) -> int:
+        """Recalcule les groupes touchés par les nouvelles annonces ; retourne leur nombre"""
+        row = conn.execute(f"SELECT last_listing_id FROM {ROLLUP_STATE_TABLE} WHERE name = ?",
+                           (self.state_name,)).fetchone()
+        last_id = row[0] if row else 0
+        max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {LISTINGS_TABLE}").fetchone()[0]
+        if max_id <= last_id:
+            return 0
+
+        groups = conn.execute(f"""
+            SELECT DISTINCT category, COALESCE(localisation, 'N/A'), date(date_scraping)
+            FROM {LISTINGS_TABLE}
+            WHERE id > ? AND id <= ?
+        """, (last_id, max_id)).fetchall()
+
+        with conn:
+            for category, localisation, day in groups:
+                self.refresh_group(conn, category, localisation, day)
+            conn.execute(f"INSERT OR REPLACE INTO {ROLLUP_STATE_TABLE} (name, last_listing_id) VALUES (?, ?)",
+                         (self.state_name, max_id))
+        logger.info(f"Agrégats: {len(groups)} groupes recalculés")
+        return len(groups)
+
+    def query(self, conn: sqlite3.Connection, category: Optional[str] = None,
+              localisation: Optional[str] = None, date_from: Optional[str] = None,
+              date_to: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Lecture des agrégats avec filtres optionnels"""
+        query = f"""
+            SELECT category, localisation, day, listing_count, priced_count, min_price,
+                   median_price, max_price, median_price_m2
+            FROM {ROLLUPS_TABLE} WHERE 1 = 1
+        """
+        params = []
+        if category:
+            query += " AND category = ?"
+            params.append(category)
+        if localisation:
+            query += " AND localisation = ?"
+            params.append(localisation)
+        if date_from:
+            query += " AND day >= ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND day <= ?"
+            params.append(date_to)
+        query += " ORDER BY day DESC, category, localisation LIMIT ?"
+        params.append(limit)
+
+        cursor = conn.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+rollup_builder = RollupBuilder()
+
 # Initialiser la base de données au démarrage de l'application
 @app.on_event("startup")
 async def startup_event():
     """Événement de démarrage pour initialiser la base de données"""
     logger.info("Démarrage de l'application - Initialisation de la base de données")
-    ensure_database_exists()
+    schema_started = time.perf_counter()
+    await db.call(ensure_database_exists)
+    STARTUP_STATS['schema_ms'] = round((time.perf_counter() - schema_started) * 1000, 2)
+    STARTUP_STATS['total_ms'] = round(STARTUP_STATS['import_ms'] + STARTUP_STATS['schema_ms'], 2)
+    logger.info(f"Démarrage: import {STARTUP_STATS['import_ms']} ms, "
+                f"schéma {STARTUP_STATS['schema_ms']} ms")
+    
+    await db.run(close_interrupted_runs)
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Arrête le planificateur et libère le pool DB et le client HTTP des images"""
+    await scheduler.stop()
+    await image_cache.close()
+    db.shutdown()
+    maintenance_db.shutdown()
 
 # Routes de l'API
 @app.get("/")
 async def root():
-    return {"message": "Mubawab Scraper API - Version Optimisée"}
+    return {"message": "Mubawab Scraper API - Version Optimisée", "startup": STARTUP_STATS}
 
 @app.get("/properties/{property_type}")
-async def get_properties(property_type: str, limit: int = 50, offset: int = 0):
-    """Récupère les propriétés d'un type donné"""
+async def get_properties(property_type: str, limit: int = 50, offset: int = 0, format: str = "json"):
+    """Récupère les propriétés d'un type donné (format=json ou format=ndjson en streaming)"""
     if property_type not in PROPERTY_CONFIGS:
         raise HTTPException(status_code=400, detail="Type de propriété invalide")
-    
-    conn = get_db_connection()  # Utiliser la nouvelle fonction
-    cursor = conn.cursor()
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format invalide (json ou ndjson)")
     
     table_name = PROPERTY_CONFIGS[property_type]['table_name']
+    query = f"""
+        SELECT * FROM {table_name} 
+        ORDER BY date_scraping DESC 
+        LIMIT ? OFFSET ?
+    """
     
-    try:
-        # Compte total
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        total = cursor.fetchone()[0]
-        
-        # Récupération des données
-        cursor.execute(f"""
-            SELECT * FROM {table_name} 
-            ORDER BY date_scraping DESC 
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
-        
-        columns = [description[0] for description in cursor.description]
-        properties = []
-        
-        for row in cursor.fetchall():
-            prop_dict = dict(zip(columns, row))
-            properties.append(prop_dict)
-        
-    except sqlite3.OperationalError as e:
-        # Si la table n'existe pas, la créer et retourner des résultats vides
-        logger.warning(f"Table {table_name} n'existe pas, création en cours...")
-        ensure_database_exists()
-        total = 0
-        properties = []
+    if format == "ndjson":
+        # Streaming ligne par ligne : aucune matérialisation de la liste complète
+        return StreamingResponse(iter_ndjson_rows(query, (limit, offset)),
+                                 media_type="application/x-ndjson")
     
-    finally:
-        conn.close()
+    try:
+        total, properties = await db.run(fetch_properties_page, table_name, query, limit, offset)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
     
-    return {
+    # Sérialisation directe (sans l'encodeur générique de FastAPI)
+    return Response(content=dumps_json({
         "properties": properties,
         "total": total,
         "limit": limit,
         "offset": offset
-    }
+    }), media_type="application/json")
 
 @app.get("/statistics")
 async def get_statistics():
     """Récupère les statistiques générales"""
-    conn = get_db_connection()  # Utiliser la nouvelle fonction
-    cursor = conn.cursor()
+    try:
+        return await db.run(count_by_category)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+
+@app.get("/export")
+async def export_all(format: str = "csv", gzip: bool = False, fields: Optional[str] = None,
+                     categories: Optional[str] = None, min_date: Optional[str] = None,
+                     max_date: Optional[str] = None, max_results_per_category: Optional[int] = None):
+    """Exporte toutes les catégories (ou une sélection séparée par des virgules) en streaming"""
+    selected = [c.strip() for c in categories.split(',') if c.strip()] if categories else list(PROPERTY_CONFIGS)
+    if any(c not in PROPERTY_CONFIGS for c in selected):
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
+
+    return export_response(selected, format, gzip, fields, min_date, max_date, max_results_per_category)
+
+@app.get("/export/{property_type}")
+async def export_property_type(property_type: str, format: str = "csv", gzip: bool = False,
+                               fields: Optional[str] = None, min_date: Optional[str] = None,
+                               max_date: Optional[str] = None, max_results: Optional[int] = None):
+    """Exporte un type de propriété en CSV ou NDJSON (streaming, gzip optionnel)"""
+    if property_type not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
+
+    return export_response([property_type], format, gzip, fields, min_date, max_date, max_results)
+
+@app.post("/scrape")
+async def start_scraping(request: ScrapingRequest):
+    """Lance le scraping parallèle pour un type de propriété"""
+    if request.property_type not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
     
-    stats = {}
+    try:
+        running = await scheduler.is_running(request.property_type)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+    if running:
+        raise HTTPException(status_code=409, detail="Un scraping est déjà en cours pour ce type")
     
-    for prop_type, config in PROPERTY_CONFIGS.items():
-        table_name = config['table_name']
-        try:
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            count = cursor.fetchone()[0]
-            stats[prop_type] = count
-        except sqlite3.OperationalError:
-            # Si la table n'existe pas encore
-            stats[prop_type] = 0
+    scheduler.launch(request.property_type, 'manual', mode='full', max_pages=request.max_pages)
+    
+    return {"message": "Scraping parallèle démarré avec 10 threads", "property_type": request.property_type}
+
+@app.post("/enrich")
+async def start_enrichment(request: EnrichmentRequest):
+    """Lance l'enrichissement des pages d'annonces (un type ou toutes les catégories)"""
+    if request.property_type and request.property_type not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
     
-    conn.close()
+    property_types = [request.property_type] if request.property_type else list(PROPERTY_CONFIGS)
+    freshness_days = request.freshness_days if request.freshness_days is not None else DETAILS_FRESHNESS_DAYS
     
-    return stats
+    try:
+        busy = await scheduler.enriching_categories(property_types)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+    if busy:
+        raise HTTPException(status_code=409, detail=f"Un enrichissement est déjà en cours: {', '.join(busy)}")
+    
+    scheduler.launch_enrichment(property_types, freshness_days, request.max_listings)
+    
+    return {"message": "Enrichissement démarré", "property_types": property_types,
+            "freshness_days": freshness_days}
 
-@app.post("/scrape")
-async def start_scraping(request: ScrapingRequest):
-    """Lance le scraping parallèle pour un type de propriété"""
+@app.post("/queue")
+async def queue_scraping(request: ScrapingRequest):
+    """Place les pages d'un type de propriété dans la file partagée des workers"""
     if request.property_type not in PROPERTY_CONFIGS:
         raise HTTPException(status_code=400, detail="Type de propriété invalide")
     
-    scraper = OptimizedMubawabScraper(request.property_type, manager, max_workers=10)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, enqueue_crawl, request.property_type, request.max_pages)
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise en file: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.get("/queue/{crawl_id}")
+async def get_queue_status(crawl_id: str):
+    """Avancement d'un crawl distribué"""
+    try:
+        status = await db.run(crawl_queue.status, crawl_id)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+    if not status["total_tasks"]:
+        raise HTTPException(status_code=404, detail="Crawl inconnu")
+    return status
+
+@app.get("/images/{image_hash}")
+async def get_image(image_hash: str):
+    """Sert une miniature depuis le cache local ; en cas d'absence, redirige vers l'image d'origine"""
+    try:
+        row = await db.run(image_cache.lookup, image_hash)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+    if row and row[1]:
+        path = image_cache.path_for(row[1])
+        if os.path.exists(path):
+            return FileResponse(path, media_type=row[2],
+                                headers={"Cache-Control": "public, max-age=31536000, immutable"})
+    
+    # Seules les URLs enregistrées depuis les annonces sont redirigées ou téléchargées
+    if row is None:
+        raise HTTPException(status_code=404, detail="Image inconnue")
     
-    async def background_scrape():
-        try:
-            await scraper.scrape_with_progress(request.max_pages)
-        except Exception as e:
-            logger.error(f"Erreur durante le scraping: {e}")
+    if IMAGE_PIPELINE_ENABLED:
+        image_cache.schedule(image_hash, row[0])
+    return RedirectResponse(row[0], status_code=307, headers={"Cache-Control": "no-store"})
+
+@app.post("/images/sync")
+async def sync_images():
+    """Télécharge les images manquantes des annonces dans le cache local"""
+    try:
+        downloaded = await image_cache.sync()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": "Synchronisation des images terminée", "downloaded": downloaded}
+
+@app.get("/duplicates")
+async def get_duplicates(limit: int = 50, offset: int = 0, refresh: bool = False):
+    """Clusters de quasi-doublons entre catégories (refresh=true traite d'abord les nouvelles annonces)"""
+    try:
+        if refresh:
+            await maintenance_db.run(duplicate_detector.update)
+        summary = await db.run(duplicate_detector.summary)
+        clusters = await db.run(duplicate_detector.clusters, limit, offset)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
     
-    asyncio.create_task(background_scrape())
+    return Response(content=dumps_json({**summary, "clusters": clusters, "limit": limit, "offset": offset}),
+                    media_type="application/json")
+
+@app.get("/analytics")
+async def get_analytics(category: Optional[str] = None, localisation: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        limit: int = 1000, refresh: bool = False):
+    """Agrégats précalculés par catégorie, localisation et jour"""
+    if category and category not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
     
-    return {"message": "Scraping parallèle démarré avec 10 threads", "property_type": request.property_type}
+    try:
+        if refresh:
+            await maintenance_db.run(rollup_builder.update)
+        rollups = await db.run(rollup_builder.query, category, localisation, date_from, date_to, limit)
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+    
+    return Response(content=dumps_json({"rollups": rollups, "count": len(rollups)}),
+                    media_type="application/json")
+
+@app.get("/runs")
+async def get_runs(property_type: Optional[str] = None, limit: int = 50):
+    """Historique des crawls (manuels et planifiés) avec leur durée"""
+    if property_type and property_type not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
+    try:
+        return {"runs": await db.run(list_runs, property_type, limit)}
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+
+@app.get("/schedule")
+async def get_schedule():
+    """Configuration et prochaines échéances du planificateur"""
+    try:
+        return await scheduler.describe()
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
+
+@app.put("/schedule/{property_type}")
+async def update_schedule(property_type: str, update: ScheduleUpdate):
+    """Modifie l'intervalle ou l'activation d'une catégorie planifiée"""
+    if property_type not in PROPERTY_CONFIGS:
+        raise HTTPException(status_code=400, detail="Type de propriété invalide")
+    if update.interval_minutes is not None and update.interval_minutes < 1:
+        raise HTTPException(status_code=400, detail="Intervalle invalide")
+    try:
+        # Enregistré en base : vaut pour le processus planificateur et survit aux redémarrages
+        await db.run(save_schedule, property_type, scheduler.intervals[property_type],
+                     update.interval_minutes, update.enabled)
+        return (await scheduler.describe())["categories"][property_type]
+    except QueryTimeoutError:
+        raise HTTPException(status_code=504, detail="Délai de requête dépassé")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -636,13 +2595,7 @@ async def websocket_endpoint(websocket: WebSocket):
 async def reset_database():
     """Réinitialise complètement la base de données"""
     try:
-        # Supprimer le fichier de base de données s'il existe
-        if os.path.exists(DB_PATH):
-            os.remove(DB_PATH)
-            logger.info("Ancien fichier de base de données supprimé")
-        
-        # Recréer la base de données
-        ensure_database_exists()
+        await db.call(recreate_database)
         
         return {"message": "Base de données réinitialisée avec succès"}
     
@@ -650,6 +2603,26 @@ async def reset_database():
         logger.error(f"Erreur lors de la réinitialisation: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de la réinitialisation: {str(e)}")
 
+STARTUP_STATS['import_ms'] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 2)
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mubawab Scraper API / worker")
+    parser.add_argument("mode", nargs="?", choices=["api", "worker", "bench"], default="api")
+    parser.add_argument("--threads", type=int, default=4, help="Nombre de workers (mode worker)")
+    parser.add_argument("--exit-when-idle", action="store_true", help="Arrêter les workers quand la file est vide")
+    parser.add_argument("--db", default=DB_PATH, help="Chemin de la base SQLite partagée")
+    args = parser.parse_args()
+    DB_PATH = args.db
+    
+    if args.mode == "worker":
+        run_workers(args.threads, args.exit_when_idle)
+    elif args.mode == "bench":
+        # Mesure du démarrage à froid : import du module + vérification du schéma
+        schema_started = time.perf_counter()
+        ensure_database_exists()
+        STARTUP_STATS['schema_ms'] = round((time.perf_counter() - schema_started) * 1000, 2)
+        STARTUP_STATS['total_ms'] = round(STARTUP_STATS['import_ms'] + STARTUP_STATS['schema_ms'], 2)
+        print(json.dumps({"startup": STARTUP_STATS}))
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file